@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import logging
 import os
 import socket
+import sys
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -123,13 +126,41 @@ DATABASES = {
     }
 }
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Redis is shared by every uWSGI worker, so feed snapshots, tiles and fetch locks are
+# cached once. Live deployments refuse to start without it (see DEPLOY_SECURE below);
+# elsewhere the per-process local memory cache stands in for it, e.g. for tests
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
     }
+    if sys.argv[1:2] != ['test']:
+        logging.getLogger(__name__).warning(
+            "REDIS_URL is not set: every process caches feed snapshots and tiles on its own"
+        )
+
+# Directory shared by the workers holding the serialized layer artifacts
+LAYER_ARTIFACT_DIR = os.getenv("LAYER_ARTIFACT_DIR", BASE_DIR / "layer_artifacts")
+
+# Seconds a live bike feed snapshot is served before it is refreshed in the background
+LIVE_FEED_TTL = {
+    'dublin-bikes': int(os.getenv("DUBLIN_BIKES_TTL", 60)),
+    'bleeper-bikes': int(os.getenv("BLEEPER_BIKES_TTL", 30)),
+    'moby-bikes': int(os.getenv("MOBY_BIKES_TTL", 30)),
 }
 
+# Directory of the daily Dublin Bikes station history blocks
+STATION_HISTORY_DIR = os.getenv("STATION_HISTORY_DIR", BASE_DIR / "station_history")
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -186,6 +217,8 @@ else:
  
 # Set DEPLOY_SECURE to True only for LIVE deployment
 if os.getenv("DEPLOY_SECURE") == "True":
+    if not os.getenv("REDIS_URL"):
+        raise ImproperlyConfigured("REDIS_URL must be set for a live deployment, every worker needs the shared cache")
     DEBUG = False
     TEMPLATES[0]["OPTIONS"]["debug"] = False
     ALLOWED_HOSTS = ['*.dublin-cycleways.xyz', 'dublin-cycleways.xyz', 'localhost', '127.0.0.1']
@@ -1,4 +1,4 @@
-const CACHE_NAME = 'cycleways-v16';
+const CACHE_NAME = 'cycleways-v18';
 const CACHE_LIFETIME = 8 * 60 * 60 * 1000; // Cache lifetime in milliseconds (24 hours)
 const CACHE_LIFETIME_LIVE = 5 * 60 * 1000; // Cache lifetime for live data in milliseconds (5 minutes)
 const urlsToCache = [
@@ -34,30 +34,65 @@ const urlsToCache = [
     'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css',
 ];
 
+const MANIFEST_URL = '/api/layers/manifest/';
+
 // Install Service Worker
 self.addEventListener('install', (event) => {
     event.waitUntil(
         caches.open(CACHE_NAME).then((cache) => {
-            const cachePromises = urlsToCache.map((url) => {
-                return fetch(url).then((response) => {
-                    const responseClone = response.clone();
-                    const headers = new Headers(responseClone.headers);
-                    headers.append('sw-cache-timestamp', Date.now().toString());
-                    const newResponse = new Response(responseClone.body, {
-                        status: responseClone.status,
-                        statusText: responseClone.statusText,
-                        headers: headers,
+            return loadManifests().then(([manifest, previousManifest]) => {
+                const cachePromises = urlsToCache.map((url) => {
+                    return reuseUnchangedLayer(cache, url, manifest, previousManifest).then((reused) => {
+                        if (reused) {
+                            return;
+                        }
+                        return fetch(url).then((response) => {
+                            return cache.put(url, stampResponse(response.clone()));
+                        });
                     });
-                    return cache.put(url, newResponse);
                 });
-            });
-            return Promise.all(cachePromises).catch((error) => {
+                if (manifest) {
+                    cachePromises.push(cache.put(MANIFEST_URL, new Response(JSON.stringify(manifest), {
+                        headers: { 'Content-Type': 'application/json' },
+                    })));
+                }
+                return Promise.all(cachePromises);
+            }).catch((error) => {
                 console.error('Failed to cache during install:', error);
             });
         })
     );
 });
 
+// Fetch the current layer manifest and find the one stored by the previous install, if any
+function loadManifests() {
+    const current = fetch(MANIFEST_URL, { cache: 'no-store' })
+        .then((response) => (response.ok ? response.json() : null))
+        .catch(() => null);
+    const previous = caches.match(MANIFEST_URL)
+        .then((response) => (response ? response.json() : null))
+        .catch(() => null);
+    return Promise.all([current, previous]);
+}
+
+// Copy a layer from the previous cache when its version did not change since the last install
+function reuseUnchangedLayer(cache, url, manifest, previousManifest) {
+    if (!manifest || !previousManifest) {
+        return Promise.resolve(false);
+    }
+    const layer = Object.keys(manifest.layers).find((name) => manifest.layers[name].url === url);
+    const previous = layer && previousManifest.layers[layer];
+    if (!previous || previous.version !== manifest.layers[layer].version) {
+        return Promise.resolve(false);
+    }
+    return caches.match(url).then((response) => {
+        if (!response) {
+            return false;
+        }
+        return cache.put(url, response).then(() => true);
+    });
+}
+
 // Fetch Cached Content
 self.addEventListener('fetch', (event) => {
     if (event.request.method === 'GET') {
@@ -70,8 +105,10 @@ self.addEventListener('fetch', (event) => {
                     const cacheLifetime = isLiveData ? CACHE_LIFETIME_LIVE : CACHE_LIFETIME;
 
                     if (cachedTimestamp && (now - parseInt(cachedTimestamp, 10)) > cacheLifetime) {
-                        // Cache expired, fetch new data
-                        return fetchAndCache(event.request);
+                        // Cache expired, check it is still current or fetch new data
+                        return response.headers.has('ETag')
+                            ? revalidate(event.request, response)
+                            : fetchAndCache(event.request);
                     }
                     return response;
                 }
@@ -81,20 +118,24 @@ self.addEventListener('fetch', (event) => {
     }
 });
 
+// Copy a response with the time it was cached, or last confirmed current
+function stampResponse(response) {
+    const headers = new Headers(response.headers);
+    headers.set('sw-cache-timestamp', Date.now().toString());
+    return new Response(response.body, {
+        status: response.status,
+        statusText: response.statusText,
+        headers: headers,
+    });
+}
+
 // Fetch and cache the request
 function fetchAndCache(request) {
     return fetch(request).then((response) => {
         if (!response.ok) {
             return response;
         }
-        const responseClone = response.clone();
-        const headers = new Headers(responseClone.headers);
-        headers.append('sw-cache-timestamp', Date.now().toString());
-        const newResponse = new Response(responseClone.body, {
-            status: responseClone.status,
-            statusText: responseClone.statusText,
-            headers: headers,
-        });
+        const newResponse = stampResponse(response.clone());
         caches.open(CACHE_NAME).then((cache) => {
             cache.put(request, newResponse);
         });
@@ -105,6 +146,34 @@ function fetchAndCache(request) {
     });
 }
 
+// Revalidate an expired cached response with its ETag: a 304 keeps the cached body and
+// only renews its timestamp, anything else replaces it
+function revalidate(request, cached) {
+    const headers = new Headers(request.headers);
+    headers.set('If-None-Match', cached.headers.get('ETag'));
+    // Bypass the HTTP cache so the 304 reaches the service worker
+    return fetch(request.url, { headers: headers, credentials: 'same-origin', cache: 'no-store' }).then((response) => {
+        if (response.status !== 304) {
+            if (response.ok) {
+                const newResponse = stampResponse(response.clone());
+                caches.open(CACHE_NAME).then((cache) => {
+                    cache.put(request, newResponse);
+                });
+            }
+            return response;
+        }
+        const renewed = stampResponse(cached);
+        const renewedClone = renewed.clone();
+        caches.open(CACHE_NAME).then((cache) => {
+            cache.put(request, renewedClone);
+        });
+        return renewed;
+    }).catch(() => {
+        // Offline: the expired copy is still better than nothing
+        return cached;
+    });
+}
+
 // Activate Service Worker and Clear Old Caches
 self.addEventListener('activate', (event) => {
     const cacheWhitelist = [CACHE_NAME];
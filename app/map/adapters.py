@@ -1,96 +1,240 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import threading
+import time
 import urllib
 import json
+import weakref
 
-def fetch_dublin_bikes_geojson():
+import httpx
+from django.core.cache import cache
+
+DUBLIN_BIKES_URL = 'https://data.smartdublin.ie/dublinbikes-api/bikes/dublin_bikes/current/stations.geojson'
+BLEEPER_BIKES_URL = 'https://data.smartdublin.ie/bleeperbike-api/bikes/bleeper_bikes/current/bikes.geojson'
+MOBY_BIKES_URL = 'https://data.smartdublin.ie/mobybikes-api/bikes/mobymoby_dublin/current/bikes.geojson'
+
+# Seconds to wait for an upstream feed before giving up, so a slow API cannot hold a worker
+FEED_TIMEOUT = 10
+FEED_CONNECT_TIMEOUT = 3
+
+# Cross-process single-flight: the lock held by the process fetching a URL and the result it shares
+FETCH_LOCK_KEY = 'fetch_lock_{url_hash}'
+FETCH_RESULT_KEY = 'fetch_result_{url_hash}'
+
+# How long the cross-process lock and the shared result outlive a fetch
+FETCH_LOCK_TIMEOUT = FEED_TIMEOUT + 5
+FETCH_RESULT_TIMEOUT = 30
+
+# Interval at which processes waiting on another process's fetch check for its result
+FETCH_POLL_INTERVAL = 0.05
+
+
+class Flight:
+    """
+    One upstream fetch in progress in this process, which concurrent callers wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+# Fetches in progress in this process, by URL
+_flights = {}
+_flights_lock = threading.Lock()
+
+# Pooled async HTTP clients with the tasks closing them, and the async fetches in progress, per event loop
+_async_clients = weakref.WeakKeyDictionary()
+_async_flights = weakref.WeakKeyDictionary()
+
+
+def wait_for_other_process(url_hash, started):
+    """
+    Wait for the process holding the fetch lock of a URL to share its result.
+    Returns None when the lock goes away or expires without a result newer than `started`.
+    """
+    deadline = time.monotonic() + FETCH_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        shared = cache.get(FETCH_RESULT_KEY.format(url_hash=url_hash))
+        if shared is not None and shared['finished_at'] >= started:
+            return shared['result']
+        if cache.get(FETCH_LOCK_KEY.format(url_hash=url_hash)) is None:
+            shared = cache.get(FETCH_RESULT_KEY.format(url_hash=url_hash))
+            return shared['result'] if shared is not None and shared['finished_at'] >= started else None
+        time.sleep(FETCH_POLL_INTERVAL)
+    return None
+
+
+def fetch_across_processes(url, fetch):
+    """
+    Run a fetch unless another process already holds the lock for the URL in the shared
+    cache, in which case its result is reused.
+    """
+    url_hash = hashlib.sha1(url.encode()).hexdigest()
+    lock_key = FETCH_LOCK_KEY.format(url_hash=url_hash)
+    started = time.time()
+    if not cache.add(lock_key, started, timeout=FETCH_LOCK_TIMEOUT):
+        result = wait_for_other_process(url_hash, started)
+        if result is not None:
+            return result
+        # The other process died or timed out, fetch without coordinating
+        return fetch()
+    try:
+        result = fetch()
+        cache.set(
+            FETCH_RESULT_KEY.format(url_hash=url_hash),
+            {'result': result, 'finished_at': time.time()},
+            timeout=FETCH_RESULT_TIMEOUT,
+        )
+        return result
+    finally:
+        cache.delete(lock_key)
+
+
+def single_flight(fetch):
+    """
+    Coalesce concurrent calls of an adapter for the same `url`: one call fetches upstream
+    and every caller waiting on it, in this process through a Flight and in other
+    processes through the shared cache, gets the same result.
+    """
+    signature = inspect.signature(fetch)
+
+    @functools.wraps(fetch)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        url = bound.arguments['url']
+
+        with _flights_lock:
+            flight = _flights.get(url)
+            leader = flight is None
+            if leader:
+                flight = _flights[url] = Flight()
+
+        if not leader:
+            if flight.done.wait(FETCH_LOCK_TIMEOUT) and flight.result is not None:
+                return flight.result
+            # The fetch we waited on failed or hung, try on our own
+            return fetch(*args, **kwargs)
+
+        try:
+            flight.result = fetch_across_processes(url, lambda: fetch(*args, **kwargs))
+            return flight.result
+        finally:
+            with _flights_lock:
+                del _flights[url]
+            flight.done.set()
+
+    return wrapper
+
+
+def transform_dublin_bikes(data):
+    """
+    Transform a Dublin Bikes stations response into the FeatureCollection served to the map.
+    """
+    features = data['features']
+    transformed_features = []
+
+    for feature in features:
+        geometry = feature['geometry']
+        properties = feature['properties']
+        transformed_feature = {
+            'type': 'Feature',
+            'geometry': geometry,
+            'properties': {
+                'Name': properties['address'],
+                'Station Number': properties['station_id'],
+                'Bikes Available': properties['num_bikes_available'],
+                'Free Stations': properties['num_docks_available'],
+            }
+        }
+        transformed_features.append(transformed_feature)
+
+    transformed_data = {
+        'type': 'FeatureCollection',
+        'features': transformed_features
+    }
+
+    return transformed_data
+
+
+def transform_general_bikes(data):
+    """
+    Transform a Bleeper or Moby bikes response into the FeatureCollection served to the map.
+    Handles cases where 'vehicle_type_id' is missing or not in the expected format.
+    """
+    features = data.get('features', [])
+    transformed_features = []
+
+    for feature in features:
+        geometry = feature.get('geometry', {})
+        properties = feature.get('properties', {})
+
+        # Handle vehicle_type_id safely
+        vehicle_type_id = properties.get('vehicle_type_id', None)
+        if vehicle_type_id:
+            # Extract part after colon only if format matches 'something:E_BIKE'
+            vehicle_type_id = (
+                vehicle_type_id.split(':')[-1]
+                if ':' in vehicle_type_id
+                else None # Otherwise, set to None
+            )
+
+        # Transform feature
+        transformed_feature = {
+            'type': 'Feature',
+            'geometry': geometry,
+            'properties': {
+                'Bike ID': properties.get('bike_id', 'N/A'),
+                'Bike Type': vehicle_type_id,
+                'Is Reserved': str(properties.get('is_reserved', False)),
+                'Is Disabled': str(properties.get('is_disabled', False)),
+                'Fuel Percent': properties.get('current_fuel_percent'),
+                'Last Updated': properties.get('last_updated_dt', 'N/A'),
+            },
+        }
+        transformed_features.append(transformed_feature)
+
+    # Final GeoJSON structure
+    transformed_data = {
+        'type': 'FeatureCollection',
+        'features': transformed_features,
+    }
+    return transformed_data
+
+
+@single_flight
+def fetch_dublin_bikes_geojson(url=DUBLIN_BIKES_URL, timeout=FEED_TIMEOUT):
     """
     Fetch Dublin Bikes API and serialize to GeoJSON using urllib.
     """
-    url = 'https://data.smartdublin.ie/dublinbikes-api/bikes/dublin_bikes/current/stations.geojson'
     try:
-        with urllib.request.urlopen(url) as response:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
             if response.status == 200:
-                data = json.loads(response.read().decode('utf-8'))
-                features = data['features']
-                transformed_features = []
-
-                for feature in features:
-                    geometry = feature['geometry']
-                    properties = feature['properties']
-                    transformed_feature = {
-                        'type': 'Feature',
-                        'geometry': geometry,
-                        'properties': {
-                            'Name': properties['address'],
-                            'Station Number': properties['station_id'],
-                            'Bikes Available': properties['num_bikes_available'],
-                            'Free Stations': properties['num_docks_available'],
-                        }
-                    }
-                    transformed_features.append(transformed_feature)
-
-                transformed_data = {
-                    'type': 'FeatureCollection',
-                    'features': transformed_features
-                }
-
-                return transformed_data
+                return transform_dublin_bikes(json.loads(response.read().decode('utf-8')))
             else:
                 raise Exception(f"Request failed with status code: {response.status}")
     except urllib.error.HTTPError as e:
         return {'error': f"HTTP Error: {e.code} - {e.reason}"}
     except urllib.error.URLError as e:
         return {'error': f"URL Error: {e.reason}"}
+    except TimeoutError:
+        return {'error': f"Timed out after {timeout}s"}
 
 import urllib.request
 import json
 
-def fetch_general_bikes_geojson(url):
+@single_flight
+def fetch_general_bikes_geojson(url, timeout=FEED_TIMEOUT):
     """
     Fetch Bleeper Bikes API and serialize to GeoJSON using urllib.
-    Handles cases where 'vehicle_type_id' is missing or not in the expected format.
     """
     try:
-        with urllib.request.urlopen(url) as response:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
             if response.status == 200:
-                data = json.loads(response.read().decode('utf-8'))
-                features = data.get('features', [])
-                transformed_features = []
-
-                for feature in features:
-                    geometry = feature.get('geometry', {})
-                    properties = feature.get('properties', {})
-
-                    # Handle vehicle_type_id safely
-                    vehicle_type_id = properties.get('vehicle_type_id', None)
-                    if vehicle_type_id:
-                        # Extract part after colon only if format matches 'something:E_BIKE'
-                        vehicle_type_id = (
-                            vehicle_type_id.split(':')[-1]
-                            if ':' in vehicle_type_id
-                            else None # Otherwise, set to None
-                        )
-
-                    # Transform feature
-                    transformed_feature = {
-                        'type': 'Feature',
-                        'geometry': geometry,
-                        'properties': {
-                            'Bike ID': properties.get('bike_id', 'N/A'),
-                            'Bike Type': vehicle_type_id,
-                            'Is Reserved': str(properties.get('is_reserved', False)),
-                            'Is Disabled': str(properties.get('is_disabled', False)),
-                            'Fuel Percent': properties.get('current_fuel_percent'),
-                            'Last Updated': properties.get('last_updated_dt', 'N/A'),
-                        },
-                    }
-                    transformed_features.append(transformed_feature)
-
-                # Final GeoJSON structure
-                transformed_data = {
-                    'type': 'FeatureCollection',
-                    'features': transformed_features,
-                }
-                return transformed_data
+                return transform_general_bikes(json.loads(response.read().decode('utf-8')))
             else:
                 raise Exception(f"Request failed with status code: {response.status}")
     except urllib.error.HTTPError as e:
@@ -100,3 +244,75 @@ def fetch_general_bikes_geojson(url):
     except Exception as e:
         return {'error': str(e)}
 
+
+async def close_on_shutdown(client):
+    """
+    Close a client when its event loop shuts down. asyncio.run, which runs every async
+    request under WSGI, cancels the tasks still pending before closing the loop.
+    """
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        await client.aclose()
+
+
+def get_async_client():
+    """
+    Return the pooled keep-alive HTTP client of the running event loop.
+
+    Connections are reused across requests instead of paying a TLS handshake per call.
+    An AsyncClient is bound to the loop it was created on, and under WSGI every async
+    request runs on its own loop, so clients are kept per loop and closed with it.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(FEED_TIMEOUT, connect=FEED_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        _async_clients[loop] = (client, loop.create_task(close_on_shutdown(client)))
+    client, _ = _async_clients[loop]
+    return client
+
+
+async def afetch_json(url, transform):
+    """
+    Fetch a feed with the pooled client and transform it, returning an error dict like the
+    sync adapters on failure. Concurrent calls for the same URL on one loop share a fetch.
+    """
+    loop = asyncio.get_running_loop()
+    flights = _async_flights.setdefault(loop, {})
+    task = flights.get(url)
+    if task is None:
+        task = flights[url] = loop.create_task(_afetch_json(url, transform))
+        task.add_done_callback(lambda _: flights.pop(url, None))
+    return await asyncio.shield(task)
+
+
+async def _afetch_json(url, transform):
+    try:
+        response = await get_async_client().get(url)
+        response.raise_for_status()
+        return transform(response.json())
+    except httpx.HTTPStatusError as e:
+        return {'error': f"HTTP Error: {e.response.status_code} - {e.response.reason_phrase}"}
+    except httpx.TimeoutException:
+        return {'error': f"Timed out after {FEED_TIMEOUT}s"}
+    except httpx.RequestError as e:
+        return {'error': f"URL Error: {e}"}
+    except Exception as e:
+        return {'error': str(e)}
+
+
+async def afetch_dublin_bikes_geojson(url=DUBLIN_BIKES_URL):
+    """
+    Async version of fetch_dublin_bikes_geojson using the pooled keep-alive client.
+    """
+    return await afetch_json(url, transform_dublin_bikes)
+
+
+async def afetch_general_bikes_geojson(url):
+    """
+    Async version of fetch_general_bikes_geojson using the pooled keep-alive client.
+    """
+    return await afetch_json(url, transform_general_bikes)
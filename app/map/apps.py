@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class MapConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'map'
+
+    def ready(self):
+        from .signals import MODEL_LAYERS, layer_model_changed
+
+        # Every change to a layer model bumps the layer versions, whether it comes from
+        # the admin, LayerMapping or a queryset delete
+        for model in MODEL_LAYERS:
+            post_save.connect(layer_model_changed, sender=model, dispatch_uid=f'layer_changed_save_{model.__name__}')
+            post_delete.connect(layer_model_changed, sender=model, dispatch_uid=f'layer_changed_delete_{model.__name__}')
@@ -0,0 +1,310 @@
+import fcntl
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+from .cache import get_layer_version
+from .serializers import serialize_layer
+
+# File suffix of each encoding of an artifact
+ARTIFACT_SUFFIXES = {
+    'identity': '.json',
+    'gzip': '.json.gz',
+    'br': '.json.br',
+}
+
+# File suffix of the metadata of an artifact: feature count and size of each encoding
+ARTIFACT_METADATA_SUFFIX = '.meta'
+
+# File name prefix of the artifacts combining several layers in one response
+BATCH_ARTIFACT_PREFIX = 'layers-'
+
+# Compression of the artifacts: layers are built once per version at the highest levels,
+# batches are combined for every layer combination on the request path, so they trade a
+# little size for build time
+LAYER_COMPRESSION = {'gzip': 9, 'br': 11}
+BATCH_COMPRESSION = {'gzip': 6, 'br': 5}
+
+
+def artifact_path(layer, version, geometry_field, encoding):
+    """
+    Return the path of one encoding of the artifact of a layer version.
+    """
+    return Path(settings.LAYER_ARTIFACT_DIR) / f'{layer}-{version}-{geometry_field}{ARTIFACT_SUFFIXES[encoding]}'
+
+
+def metadata_path(layer, version, geometry_field):
+    """
+    Return the path of the metadata of the artifact of a layer version.
+    """
+    return Path(settings.LAYER_ARTIFACT_DIR) / f'{layer}-{version}-{geometry_field}{ARTIFACT_METADATA_SUFFIX}'
+
+
+def batch_artifact_path(name, encoding):
+    """
+    Return the path of one encoding of a batch artifact.
+    """
+    return Path(settings.LAYER_ARTIFACT_DIR) / f'{name}{ARTIFACT_SUFFIXES[encoding]}'
+
+
+def batch_metadata_path(name):
+    """
+    Return the path of the metadata of a batch artifact: the version of each layer it combines.
+    """
+    return Path(settings.LAYER_ARTIFACT_DIR) / f'{name}{ARTIFACT_METADATA_SUFFIX}'
+
+
+def batch_artifact_name(layers, versions):
+    """
+    Return the name of the batch artifact combining the given versions of layers, in order.
+    """
+    digest = hashlib.sha256(repr(list(zip(layers, versions))).encode('utf-8')).hexdigest()[:16]
+    return f'{BATCH_ARTIFACT_PREFIX}{digest}'
+
+
+def encode_body(body, compression=LAYER_COMPRESSION):
+    """
+    Return a response body along with its compressed variants, by encoding.
+    """
+    artifact = {
+        'identity': body,
+        'gzip': gzip.compress(body, compresslevel=compression['gzip']),
+    }
+    if brotli is not None:
+        artifact['br'] = brotli.compress(body, quality=compression['br'])
+    return artifact
+
+
+def build_layer_artifact(layer, geometry_field='geometry'):
+    """
+    Serialize a layer once into final UTF-8 bytes along with its compressed variants.
+    Returns the bytes by encoding and the number of features.
+    """
+    collection = serialize_layer(layer, geometry_field=geometry_field)
+    body = json.dumps(collection, separators=(',', ':')).encode('utf-8')
+    return encode_body(body), len(collection['features'])
+
+
+def write_file(directory, path, content):
+    """
+    Write a file under a temporary name and rename it into place, so readers only ever see it complete.
+    """
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+
+def write_layer_artifact(layer, version, geometry_field='geometry'):
+    """
+    Build the artifact of a layer version into the shared artifact directory and remove
+    the files of its older versions.
+
+    Every file is written atomically and the identity file goes last, so its presence
+    marks the artifact and its metadata complete.
+    """
+    directory = Path(settings.LAYER_ARTIFACT_DIR)
+    os.makedirs(directory, exist_ok=True)
+    artifact, feature_count = build_layer_artifact(layer, geometry_field)
+    metadata = {
+        'feature_count': feature_count,
+        'bytes': {encoding: len(content) for encoding, content in artifact.items()},
+    }
+    write_file(directory, metadata_path(layer, version, geometry_field), json.dumps(metadata).encode('utf-8'))
+    for encoding in sorted(artifact, key=lambda encoding: encoding == 'identity'):
+        write_file(directory, artifact_path(layer, version, geometry_field, encoding), artifact[encoding])
+
+    for path in directory.glob(f'{layer}-*-{geometry_field}.*'):
+        old_version = path.name[len(layer) + 1:].split('-', 1)[0]
+        if old_version.isdigit() and int(old_version) < version:
+            # Workers still sending the old file keep it open until they finish
+            path.unlink(missing_ok=True)
+    remove_stale_batches(layer, version)
+
+
+def remove_stale_batches(layer, version):
+    """
+    Remove the batch artifacts combining an older version of a layer. Batches of current
+    versions are left alone, as workers may be about to open them.
+    """
+    for path in Path(settings.LAYER_ARTIFACT_DIR).glob(f'{BATCH_ARTIFACT_PREFIX}*{ARTIFACT_METADATA_SUFFIX}'):
+        try:
+            with open(path, 'rb') as f:
+                batch_version = json.load(f)['versions'].get(layer)
+        except FileNotFoundError:
+            # Removed by another worker's cleanup
+            continue
+        if batch_version is not None and batch_version < version:
+            name = path.name[:-len(ARTIFACT_METADATA_SUFFIX)]
+            # The identity file goes first so the batch is no longer complete, the metadata last
+            for encoding in sorted(ARTIFACT_SUFFIXES, key=lambda encoding: encoding != 'identity'):
+                batch_artifact_path(name, encoding).unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+
+
+@contextmanager
+def build_lock(path):
+    """
+    Hold the lock on building the artifact a file belongs to, shared by every worker using
+    the artifact directory. Every file of an artifact maps to the same lock.
+    """
+    os.makedirs(path.parent, exist_ok=True)
+    lock_path = path.with_name(f'.{path.name.split(".", 1)[0]}.lock')
+    with open(lock_path, 'wb') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            # Waiters still locking the unlinked file find the artifact built and do not rebuild
+            lock_path.unlink(missing_ok=True)
+
+
+def open_file(path, build):
+    """
+    Open a file of an artifact, building the artifact first when the file is missing.
+
+    The file is opened rather than checked for, so one removed by another worker's cleanup
+    in between is built again instead of failing the request; once open, it stays readable
+    even if it is unlinked. One worker builds a missing artifact while the others wait for it.
+    """
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    with build_lock(path):
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            build()
+            return open(path, 'rb')
+
+
+def open_artifact(path_of, build):
+    """
+    Open the files of an artifact by encoding, building it when its identity file, which
+    is written last, is missing. Encodings removed along with an older version are left out.
+    """
+    files = {'identity': open_file(path_of('identity'), build)}
+    for encoding in ARTIFACT_SUFFIXES:
+        if encoding != 'identity':
+            try:
+                files[encoding] = open(path_of(encoding), 'rb')
+            except FileNotFoundError:
+                continue
+    return files
+
+
+def get_layer_metadata(layer, geometry_field='geometry'):
+    """
+    Return the version, feature count and size of each encoding of the current artifact of a layer.
+    """
+    version = get_layer_version(layer)
+    build = partial(write_layer_artifact, layer, version, geometry_field)
+    with open_file(metadata_path(layer, version, geometry_field), build) as f:
+        return dict(json.load(f), version=version)
+
+
+def get_layer_artifact(layer, geometry_field='geometry', version=None):
+    """
+    Open the files of the artifact of a layer version, the current one by default, by
+    encoding, building it on the first request for each layer version.
+
+    The files live in a directory shared by every worker, so each version is built once
+    and served by all of them from the same page cache pages.
+    """
+    if version is None:
+        version = get_layer_version(layer)
+    return open_artifact(
+        partial(artifact_path, layer, version, geometry_field),
+        partial(write_layer_artifact, layer, version, geometry_field),
+    )
+
+
+def write_batch_artifact(name, layers, versions):
+    """
+    Combine the artifacts of several layer versions into one JSON object keyed by layer.
+
+    The encoded FeatureCollection of each layer is spliced in as is from its memory-mapped
+    identity file, so nothing is parsed or serialized again; only the compressed variants
+    of the combined body are computed. The metadata records the layer versions for cleanup.
+    """
+    directory = Path(settings.LAYER_ARTIFACT_DIR)
+    parts = []
+    with ExitStack() as stack:
+        for index, (layer, version) in enumerate(zip(layers, versions)):
+            f = stack.enter_context(open_file(
+                artifact_path(layer, version, 'geometry', 'identity'),
+                partial(write_layer_artifact, layer, version),
+            ))
+            parts.append(('{' if index == 0 else ',').encode('utf-8') + json.dumps(layer).encode('utf-8') + b':')
+            parts.append(stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)))
+        parts.append(b'}')
+        body = b''.join(parts)
+    artifact = encode_body(body, BATCH_COMPRESSION)
+    metadata = {'versions': dict(zip(layers, versions))}
+    write_file(directory, batch_metadata_path(name), json.dumps(metadata).encode('utf-8'))
+    for encoding in sorted(artifact, key=lambda encoding: encoding == 'identity'):
+        write_file(directory, batch_artifact_path(name, encoding), artifact[encoding])
+
+
+def get_batch_artifact(layers, versions):
+    """
+    Open the files of the batch artifact of the given layer versions by encoding,
+    building it on the first request for that combination.
+    """
+    name = batch_artifact_name(layers, versions)
+    os.makedirs(settings.LAYER_ARTIFACT_DIR, exist_ok=True)
+    return open_artifact(partial(batch_artifact_path, name), partial(write_batch_artifact, name, layers, versions))
+
+
+def negotiate_encoding(accept_encoding, artifact):
+    """
+    Pick the best content encoding available in the artifact for an Accept-Encoding header.
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    for encoding in ('br', 'gzip'):
+        if encoding in artifact and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+def artifact_response(artifact, encoding):
+    """
+    Serve the open file of an artifact in the negotiated encoding and close the others.
+    The file is handed to the server's file wrapper, which sends it with sendfile.
+    """
+    for other, f in artifact.items():
+        if other != encoding:
+            f.close()
+    response = FileResponse(artifact[encoding], content_type='application/json')
+    # FileResponse names the file for downloads, the layer is an API response
+    del response['Content-Disposition']
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,50 @@
+import hashlib
+import time
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import LayerVersion
+
+
+def get_layer_version(layer):
+    """
+    Return the current version of a layer for use in cache keys, file names and ETags.
+
+    Versions live in the database, so a bump made by any process (a worker, the admin, a
+    management command) is seen by every worker once it commits. A layer's first version
+    is seeded from the clock rather than from 1, so a recreated database never hands out
+    a version that was already used for older artifacts or ETags.
+    """
+    state, _ = LayerVersion.objects.get_or_create(
+        layer=layer,
+        defaults={'version': time.time_ns() // 1000, 'modified_at': timezone.now()},
+    )
+    return state.version
+
+
+def invalidate_layer(layer):
+    """
+    Bump the version of a layer. Every cache key derived from the layer includes its version,
+    so all of them miss on the next request and the entries of older versions simply expire.
+    """
+    # Without a row nothing was served yet, the next read seeds a fresh version
+    LayerVersion.objects.filter(layer=layer).update(version=F('version') + 1, modified_at=timezone.now())
+
+
+def get_layer_modified(layer, version):
+    """
+    Return the Unix time a version of a layer came into effect, or the current time when
+    it is no longer the current version.
+    """
+    modified = LayerVersion.objects.filter(layer=layer, version=version).values_list('modified_at', flat=True).first()
+    return int((modified or timezone.now()).timestamp())
+
+
+def layer_etag(layer, version, *variant):
+    """
+    Return a strong ETag for one representation of a layer version. The variant holds
+    everything else that changes the response bytes: geometry column, encoding, bbox.
+    """
+    digest = hashlib.sha256(repr(variant).encode('utf-8')).hexdigest()[:16]
+    return f'"{layer}-{version}-{digest}"'
@@ -0,0 +1,298 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from . import history
+from .adapters import (
+    BLEEPER_BIKES_URL,
+    DUBLIN_BIKES_URL,
+    MOBY_BIKES_URL,
+    afetch_dublin_bikes_geojson,
+    afetch_general_bikes_geojson,
+    fetch_dublin_bikes_geojson,
+    fetch_general_bikes_geojson,
+)
+
+# Live bike feeds: sync and async adapters, upstream URL, seconds a fetched snapshot is
+# served as fresh and the feature property identifying a station or bike across snapshots.
+# Feeds with 'history' have every new snapshot appended to the station history blocks.
+# The TTLs can be overridden per feed with the LIVE_FEED_TTL setting.
+FEEDS = {
+    'dublin-bikes': {
+        'adapter': fetch_dublin_bikes_geojson,
+        'async_adapter': afetch_dublin_bikes_geojson,
+        'url': DUBLIN_BIKES_URL,
+        'ttl': 60,
+        'id_property': 'Station Number',
+        'history': True,
+    },
+    'bleeper-bikes': {
+        'adapter': fetch_general_bikes_geojson,
+        'async_adapter': afetch_general_bikes_geojson,
+        'url': BLEEPER_BIKES_URL,
+        'ttl': 30,
+        'id_property': 'Bike ID',
+    },
+    'moby-bikes': {
+        'adapter': fetch_general_bikes_geojson,
+        'async_adapter': afetch_general_bikes_geojson,
+        'url': MOBY_BIKES_URL,
+        'ttl': 30,
+        'id_property': 'Bike ID',
+    },
+}
+
+# Cache key holding the last good snapshot of a feed with the time it was fetched
+FEED_CACHE_KEY = 'feed_{name}'
+
+# Cache keys of the version counter of a feed's snapshots and of the features of each
+# recent version, kept so clients can ask for the changes since the version they hold
+FEED_VERSION_KEY = 'feed_version_{name}'
+FEED_HISTORY_KEY = 'feed_history_{name}_{version}'
+
+# Number of recent versions kept per feed; older ones fall out like a ring buffer
+FEED_HISTORY_SIZE = 10
+
+# Cache key holding the circuit breaker state of a feed: consecutive failures, when the
+# breaker closes again and the last error
+FEED_HEALTH_KEY = 'feed_health_{name}'
+
+# Consecutive upstream failures after which a feed's breaker opens, and how long it stays
+# open: doubling from the base on every further failure up to the maximum
+BREAKER_THRESHOLD = 3
+BREAKER_BASE_BACKOFF = 30
+BREAKER_MAX_BACKOFF = 15 * 60
+
+# Cache key the poll_feeds command refreshes while it polls a feed; request handlers
+# leave fetching that feed to the poller while it is present
+POLLER_HEARTBEAT_KEY = 'feed_poller_heartbeat_{name}'
+
+# Feeds with a background refresh running in this process
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+# A feed snapshot as served to clients; version is None when there is no snapshot
+Snapshot = namedtuple('Snapshot', ['data', 'age', 'stale', 'version'])
+
+
+def feed_ttl(name):
+    """
+    Return how many seconds a snapshot of a feed is served without refreshing it.
+    """
+    return getattr(settings, 'LIVE_FEED_TTL', {}).get(name, FEEDS[name]['ttl'])
+
+
+def fetch_feed(name):
+    """
+    Fetch and transform a feed from upstream with its adapter.
+    """
+    feed = FEEDS[name]
+    return feed['adapter'](feed['url'])
+
+
+def get_health(name):
+    """
+    Return the circuit breaker state of a feed.
+    """
+    return cache.get(FEED_HEALTH_KEY.format(name=name)) or {'failures': 0, 'open_until': 0, 'last_error': None}
+
+
+def breaker_open(name):
+    """
+    Check whether upstream calls for a feed are suspended after repeated failures.
+    """
+    return get_health(name)['open_until'] > time.time()
+
+
+def next_feed_version(name):
+    """
+    Return the next snapshot version of a feed. A missing counter is seeded from the
+    clock, so a flushed cache never reuses versions clients may still hold.
+    """
+    key = FEED_VERSION_KEY.format(name=name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        seed = time.time_ns() // 1000
+        return seed if cache.add(key, seed, timeout=None) else cache.incr(key)
+
+
+def diff_features(name, old_features, new_features):
+    """
+    Compare two snapshots of a feed by station or bike id.
+
+    Returns the features added and changed (new counts, moved positions) in full and the
+    ids of the features removed.
+    """
+    id_property = FEEDS[name]['id_property']
+    old = {feature['properties'].get(id_property): feature for feature in old_features}
+    new = {feature['properties'].get(id_property): feature for feature in new_features}
+    return {
+        'added': [feature for key, feature in new.items() if key not in old],
+        'changed': [feature for key, feature in new.items() if key in old and old[key] != feature],
+        'removed': [key for key in old if key not in new],
+    }
+
+
+def get_delta(name, since, snapshot):
+    """
+    Return the changes between version `since` of a feed and a snapshot, or None when
+    that version is no longer kept and the client needs the full snapshot.
+    """
+    if since == snapshot.version:
+        return {'added': [], 'changed': [], 'removed': []}
+    features = cache.get(FEED_HISTORY_KEY.format(name=name, version=since))
+    if features is None:
+        return None
+    return diff_features(name, features, snapshot.data['features'])
+
+
+def record_result(name, data):
+    """
+    Store a fetched feed as the last good snapshot, or count the failure and open the
+    breaker with exponential backoff once failures repeat. Errors are never cached as
+    snapshots, so a failing upstream leaves the last good snapshot in place.
+    """
+    if 'error' not in data:
+        previous = cache.get(FEED_CACHE_KEY.format(name=name))
+        if previous is not None and previous['data'] == data:
+            version = previous['version']
+        else:
+            version = next_feed_version(name)
+            cache.set(FEED_HISTORY_KEY.format(name=name, version=version), data['features'], timeout=None)
+            cache.delete(FEED_HISTORY_KEY.format(name=name, version=version - FEED_HISTORY_SIZE))
+            # Only new snapshots are sampled, every caller sharing one fetch records the same data
+            if FEEDS[name].get('history'):
+                try:
+                    history.append_snapshot(data)
+                except (OSError, KeyError, TypeError, ValueError, OverflowError):
+                    # History is best effort, it must never cost the live feed its snapshot
+                    logger.exception(f"Could not record station history for {name}")
+        cache.set(
+            FEED_CACHE_KEY.format(name=name),
+            {'data': data, 'fetched_at': time.time(), 'version': version},
+            timeout=None,
+        )
+        cache.delete(FEED_HEALTH_KEY.format(name=name))
+        return
+
+    health = get_health(name)
+    health['failures'] += 1
+    health['last_error'] = data['error']
+    if health['failures'] >= BREAKER_THRESHOLD:
+        backoff = BREAKER_BASE_BACKOFF * 2 ** (health['failures'] - BREAKER_THRESHOLD)
+        health['open_until'] = time.time() + min(backoff, BREAKER_MAX_BACKOFF)
+    cache.set(FEED_HEALTH_KEY.format(name=name), health, timeout=None)
+
+
+def refresh_feed(name):
+    """
+    Fetch a feed and store it as the current snapshot, unless its breaker is open.
+    """
+    if breaker_open(name):
+        return {'error': f"Upstream for {name} is failing, retrying later"}
+    data = fetch_feed(name)
+    record_result(name, data)
+    return data
+
+
+def poller_running(name):
+    """
+    Check whether the poll_feeds command is keeping the snapshots of a feed up to date.
+    """
+    return cache.get(POLLER_HEARTBEAT_KEY.format(name=name)) is not None
+
+
+def _refresh_and_release(name):
+    try:
+        refresh_feed(name)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(name)
+
+
+def refresh_in_background(name):
+    """
+    Refresh a feed in a daemon thread, unless this process is already refreshing it.
+    """
+    with _refreshing_lock:
+        if name in _refreshing:
+            return
+        _refreshing.add(name)
+    threading.Thread(target=_refresh_and_release, args=(name,), daemon=True).start()
+
+
+def get_feed(name):
+    """
+    Return the latest Snapshot of a feed: its data, age in seconds, whether it is stale and its version.
+
+    Snapshots are served straight from the cache. While the poll_feeds command runs it
+    keeps them fresh; without it a stale snapshot is still served immediately while a
+    background refresh fetches the next one (stale-while-revalidate). Only when there is
+    no snapshot at all does the request wait for upstream.
+    """
+    entry = cache.get(FEED_CACHE_KEY.format(name=name))
+    if entry is None:
+        data = refresh_feed(name)
+        entry = cache.get(FEED_CACHE_KEY.format(name=name)) if 'error' not in data else None
+        return Snapshot(data, 0, False, entry and entry['version'])
+
+    age = time.time() - entry['fetched_at']
+    stale = age >= feed_ttl(name)
+    if stale and not poller_running(name):
+        refresh_in_background(name)
+    return Snapshot(entry['data'], age, stale, entry['version'])
+
+
+async def afetch_feed(name):
+    """
+    Fetch and transform a feed from upstream with its async adapter.
+    """
+    feed = FEEDS[name]
+    return await feed['async_adapter'](feed['url'])
+
+
+async def arefresh_feed(name):
+    """
+    Async version of refresh_feed.
+    """
+    if await sync_to_async(breaker_open)(name):
+        return {'error': f"Upstream for {name} is failing, retrying later"}
+    data = await afetch_feed(name)
+    await sync_to_async(record_result)(name, data)
+    return data
+
+
+async def aget_snapshot(name):
+    """
+    Return the cached snapshot entry of a feed, or None when there is none yet. A stale
+    snapshot is refreshed in a background thread unless the poller owns the feed: a task
+    on the running loop would be cancelled when a request's loop closes under WSGI.
+    """
+    entry = await cache.aget(FEED_CACHE_KEY.format(name=name))
+    if (entry is not None
+            and time.time() - entry['fetched_at'] >= feed_ttl(name)
+            and await cache.aget(POLLER_HEARTBEAT_KEY.format(name=name)) is None):
+        refresh_in_background(name)
+    return entry
+
+
+async def aget_feed(name):
+    """
+    Async version of get_feed.
+    """
+    entry = await aget_snapshot(name)
+    if entry is None:
+        data = await arefresh_feed(name)
+        entry = await cache.aget(FEED_CACHE_KEY.format(name=name)) if 'error' not in data else None
+        return Snapshot(data, 0, False, entry and entry['version'])
+
+    age = time.time() - entry['fetched_at']
+    return Snapshot(entry['data'], age, age >= feed_ttl(name), entry['version'])
@@ -0,0 +1,39 @@
+from django.contrib.gis.db.models.functions import GeoFunc
+
+# Precomputed simplified geometry columns of the line layers, one per zoom band:
+# (highest zoom level of the band, column, simplification tolerance in degrees).
+# Tolerances are about half a screen pixel at the band's highest zoom, zoom
+# levels above the last band are served the full resolution `geometry` column.
+GENERALIZATION_BANDS = (
+    (11, 'geometry_low', 0.0003),
+    (14, 'geometry_mid', 0.00004),
+)
+
+GEOMETRY_FIELDS = ('geometry',) + tuple(field for _, field, _ in GENERALIZATION_BANDS)
+
+
+class SimplifyPreserveTopology(GeoFunc):
+    """
+    PostGIS ST_SimplifyPreserveTopology, which Django does not ship as a GIS function.
+    """
+    function = 'ST_SimplifyPreserveTopology'
+
+
+def geometry_field_for_zoom(zoom):
+    """
+    Return the geometry column to serve for a map zoom level.
+    """
+    for max_zoom, field, _ in GENERALIZATION_BANDS:
+        if zoom <= max_zoom:
+            return field
+    return 'geometry'
+
+
+def geometry_field_for_tolerance(tolerance):
+    """
+    Return the most simplified geometry column whose tolerance does not exceed the requested one.
+    """
+    for _, field, band_tolerance in GENERALIZATION_BANDS:
+        if band_tolerance <= tolerance:
+            return field
+    return 'geometry'
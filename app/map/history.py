@@ -0,0 +1,156 @@
+import datetime
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+# One availability sample of one station: 10 bytes per station per poll. Signed, so
+# arithmetic on the columns cannot wrap around
+RECORD_DTYPE = np.dtype([
+    ('time', '<u4'),
+    ('station', '<i2'),
+    ('bikes', '<i2'),
+    ('docks', '<i2'),
+])
+
+# Largest station number and count a record holds
+RECORD_MAX = np.iinfo(np.int16).max
+
+# Percentiles reported when none are asked for
+DEFAULT_PERCENTILES = (10, 50, 90)
+
+
+def block_path(day, station):
+    """
+    Return the path of the append-only block holding the samples of one station on one UTC day.
+    """
+    return Path(settings.STATION_HISTORY_DIR) / f'{day:%Y-%m-%d}' / f'{station}.bin'
+
+
+def legacy_block_path(day):
+    """
+    Return the path of the block holding the samples of every station on one UTC day, as
+    written before the blocks were split per station.
+    """
+    return Path(settings.STATION_HISTORY_DIR) / f'{day:%Y-%m-%d}.bin'
+
+
+def station_record(timestamp, properties):
+    """
+    Return the record of one station in a snapshot, with its counts clamped to the record
+    range, or None when its number or counts are missing or not integers.
+    """
+    try:
+        station = int(properties['Station Number'])
+        bikes = int(properties['Bikes Available'])
+        docks = int(properties['Free Stations'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not 0 <= station <= RECORD_MAX:
+        return None
+    return timestamp, station, min(max(bikes, 0), RECORD_MAX), min(max(docks, 0), RECORD_MAX)
+
+
+def append_snapshot(data, timestamp=None):
+    """
+    Append the bike and dock counts of every station in a Dublin Bikes snapshot to the
+    blocks of the current day, one block per station so a station's history is read
+    without the others. Stations with invalid values are skipped.
+    """
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    records = [station_record(timestamp, feature['properties']) for feature in data['features']]
+    records = np.array([record for record in records if record is not None], dtype=RECORD_DTYPE)
+    day = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date()
+    os.makedirs(block_path(day, 0).parent, exist_ok=True)
+    for station in np.unique(records['station']):
+        # A single O_APPEND write, so samples from concurrent writers never interleave
+        with open(block_path(day, station), 'ab') as f:
+            f.write(records[records['station'] == station].tobytes())
+
+
+def load_samples(station, days):
+    """
+    Return the samples of one station over the last `days` UTC days, ordered by time.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    blocks = []
+    for offset in range(days - 1, -1, -1):
+        day = today - datetime.timedelta(days=offset)
+        path = block_path(day, station)
+        if path.exists():
+            blocks.append(np.fromfile(path, dtype=RECORD_DTYPE))
+        legacy = legacy_block_path(day)
+        if legacy.exists() and legacy.stat().st_size:
+            # Mapped rather than read, only the records of the station are copied
+            records = np.memmap(legacy, dtype=RECORD_DTYPE, mode='r')
+            blocks.append(np.array(records[records['station'] == station]))
+    if not blocks:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    samples = np.concatenate(blocks)
+    return samples[np.argsort(samples['time'], kind='stable')]
+
+
+def hourly_aggregates(station, days=1):
+    """
+    Aggregate the samples of a station per UTC hour: sample count and the mean, minimum
+    and maximum of available bikes and docks.
+    """
+    samples = load_samples(station, days)
+    if not len(samples):
+        return []
+    hours = samples['time'].astype(np.int64) // 3600
+    # Samples are sorted by time, so each hour is one contiguous run
+    starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+    counts = np.diff(np.r_[starts, len(samples)])
+    aggregates = {'samples': counts}
+    means = {}
+    for column in ('bikes', 'docks'):
+        values = samples[column].astype(np.int64)
+        means[f'{column}_mean'] = np.add.reduceat(values, starts) / counts
+        aggregates[f'{column}_min'] = np.minimum.reduceat(values, starts)
+        aggregates[f'{column}_max'] = np.maximum.reduceat(values, starts)
+    return [
+        {
+            'hour': datetime.datetime.fromtimestamp(int(hours[start]) * 3600, datetime.timezone.utc).isoformat(),
+            **{key: int(values[index]) for key, values in aggregates.items()},
+            **{key: round(float(values[index]), 2) for key, values in means.items()},
+        }
+        for index, start in enumerate(starts)
+    ]
+
+
+def grouped_percentiles(groups, values, percentiles):
+    """
+    Compute linearly interpolated percentiles of values per group in one pass: values are
+    sorted within their group and every percentile is read at its fractional rank.
+    Returns the sorted unique groups and a (groups, percentiles) array.
+    """
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order].astype(np.float64)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    ranks = starts[:, None] + (counts[:, None] - 1) * (np.asarray(percentiles, dtype=np.float64)[None, :] / 100)
+    lower = np.floor(ranks).astype(np.int64)
+    upper = np.ceil(ranks).astype(np.int64)
+    return groups[starts], values[lower] + (values[upper] - values[lower]) * (ranks - lower)
+
+
+def hour_of_day_percentiles(station, days=28, percentiles=DEFAULT_PERCENTILES):
+    """
+    Percentiles of the bikes and docks available at a station for each UTC hour of the day,
+    over the last `days` days.
+    """
+    samples = load_samples(station, days)
+    if not len(samples):
+        return []
+    hour_of_day = (samples['time'].astype(np.int64) // 3600) % 24
+    results = {}
+    for column in ('bikes', 'docks'):
+        hours, values = grouped_percentiles(hour_of_day, samples[column], percentiles)
+        for hour, row in zip(hours, values):
+            results.setdefault(int(hour), {'hour': int(hour)})[column] = {
+                f'p{percentile:g}': round(float(value), 2) for percentile, value in zip(percentiles, row)
+            }
+    return [results[hour] for hour in sorted(results)]
@@ -0,0 +1,252 @@
+import math
+
+from django.contrib.gis.geos import GeometryCollection, MultiLineString
+
+from django.db import connection
+
+from .models import (
+    CountyCycleway,
+    CountyRoad,
+    CyclewaysDublinMetro,
+    CyclewaysSDCC,
+    RedCyclingInfrastructure,
+    YellowCyclingInfrastructure,
+)
+
+# Red and Yellow infrastructure computed in one statement inside PostGIS: every road is
+# differenced against the union of only the cycleways intersecting it, found through the
+# spatial indexes, and both layers are written with INSERT ... SELECT.
+MISSING_INFRASTRUCTURE_SQL = """
+    WITH yellow AS (
+        SELECT
+            r.id AS road_id,
+            r.name,
+            ST_Multi(ST_CollectionExtract(
+                COALESCE(ST_Difference(r.geometry, segregated.geometry), r.geometry), 2
+            )) AS geometry
+        FROM {road} r
+        LEFT JOIN LATERAL (
+            SELECT ST_Union(c.geometry) AS geometry
+            FROM (
+                SELECT s.geometry FROM {sdcc} s WHERE ST_Intersects(s.geometry, r.geometry)
+                UNION ALL
+                SELECT m.geometry FROM {dublin_metro} m WHERE ST_Intersects(m.geometry, r.geometry)
+            ) c
+        ) segregated ON true
+    ),
+    red AS (
+        SELECT
+            y.road_id,
+            y.name,
+            ST_Multi(ST_CollectionExtract(
+                COALESCE(ST_Difference(y.geometry, cycleways.geometry), y.geometry), 2
+            )) AS geometry
+        FROM yellow y
+        LEFT JOIN LATERAL (
+            SELECT ST_Union(c.geometry) AS geometry
+            FROM {cycleway} c
+            WHERE ST_Intersects(c.geometry, y.geometry)
+        ) cycleways ON true
+        WHERE NOT ST_IsEmpty(y.geometry)
+    ),
+    inserted_yellow AS (
+        INSERT INTO {yellow} (road_id, name, geometry)
+        SELECT road_id, name, geometry FROM yellow WHERE NOT ST_IsEmpty(geometry)
+    )
+    INSERT INTO {red} (road_id, name, geometry)
+    SELECT road_id, name, geometry FROM red WHERE NOT ST_IsEmpty(geometry)
+"""
+
+# Cycleway trees of the current process, built once per worker by load_cycleway_trees()
+_trees = None
+
+
+def extents_intersect(a, b):
+    """
+    Check whether two (xmin, ymin, xmax, ymax) extents overlap.
+    """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def merge_extents(nodes):
+    """
+    Return the extent covering every node of a list of (extent, children) nodes.
+    """
+    return (
+        min(extent[0] for extent, _ in nodes),
+        min(extent[1] for extent, _ in nodes),
+        max(extent[2] for extent, _ in nodes),
+        max(extent[3] for extent, _ in nodes),
+    )
+
+
+class STRtree:
+    """
+    Static R-tree over geometry envelopes, bulk loaded with Sort-Tile-Recursive packing.
+
+    Leaves are (extent, index into `geometries`) pairs, inner nodes are
+    (extent, list of child nodes) pairs.
+    """
+
+    def __init__(self, geometries, node_capacity=10):
+        self.geometries = list(geometries)
+        self.node_capacity = node_capacity
+        level = [(geometry.extent, index) for index, geometry in enumerate(self.geometries) if not geometry.empty]
+        while len(level) > node_capacity:
+            level = self._pack(level)
+        self.root = (merge_extents(level), level) if level else None
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def _pack(self, nodes):
+        """
+        Group one tree level into parent nodes: sort by x into vertical slices, then by y within each slice.
+        """
+        capacity = self.node_capacity
+        slice_count = math.ceil(math.sqrt(math.ceil(len(nodes) / capacity)))
+        slice_size = slice_count * capacity
+        nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][2])
+        parents = []
+        for start in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(nodes[start:start + slice_size], key=lambda node: node[0][1] + node[0][3])
+            for offset in range(0, len(vertical_slice), capacity):
+                children = vertical_slice[offset:offset + capacity]
+                parents.append((merge_extents(children), children))
+        return parents
+
+    def query(self, extent):
+        """
+        Return the geometries whose envelope intersects the given extent.
+        """
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_extent, children = stack.pop()
+            if not extents_intersect(node_extent, extent):
+                continue
+            if isinstance(children, int):
+                results.append(self.geometries[children])
+            else:
+                stack.extend(children)
+        return results
+
+
+def local_union(tree, geometry):
+    """
+    Union the indexed geometries that intersect a geometry, or return None when none do.
+    """
+    prepared = geometry.prepared
+    candidates = [candidate for candidate in tree.query(geometry.extent) if prepared.intersects(candidate)]
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+    return GeometryCollection(*candidates, srid=geometry.srid).unary_union
+
+
+def to_multilinestring(geometry):
+    """
+    Normalize a difference result for the MultiLineString red/yellow columns, None when nothing is left.
+    """
+    if geometry.empty:
+        return None
+    if geometry.geom_type == 'LineString':  # Wrap LineString as MultiLineString
+        return MultiLineString(geometry, srid=geometry.srid)
+    return geometry
+
+
+def compute_road(road_geometry, segregated_tree, cycleway_tree):
+    """
+    Split a road into its Red (no cycling infrastructure) and Yellow (no segregated
+    infrastructure) parts, subtracting only the cycleways that actually touch it.
+    """
+    segregated = local_union(segregated_tree, road_geometry)
+    yellow = road_geometry.difference(segregated) if segregated else road_geometry
+    if yellow.empty:
+        return None, None
+    cycleways = local_union(cycleway_tree, yellow)
+    red = yellow.difference(cycleways) if cycleways else yellow
+    return to_multilinestring(red), to_multilinestring(yellow)
+
+
+def load_cycleway_trees():
+    """
+    Index the segregated cycleways of both models and the non-segregated cycleways for this process.
+    """
+    global _trees
+    segregated_geometries = list(CyclewaysSDCC.objects.values_list('geometry', flat=True))
+    segregated_geometries += list(CyclewaysDublinMetro.objects.values_list('geometry', flat=True))
+    _trees = (
+        STRtree(segregated_geometries),
+        STRtree(CountyCycleway.objects.values_list('geometry', flat=True)),
+    )
+    return _trees
+
+
+def partition_roads(size):
+    """
+    Split the county roads into primary key ranges of at most `size` roads.
+    """
+    pks = list(CountyRoad.objects.order_by('pk').values_list('pk', flat=True))
+    return [(pks[start], pks[min(start + size, len(pks)) - 1]) for start in range(0, len(pks), size)]
+
+
+def process_roads(roads):
+    """
+    Compute the Red and Yellow parts of the roads in a queryset.
+
+    Returns the number of roads processed and a list of (road pk, road name, red, yellow)
+    tuples; GEOS geometries pickle, so this runs equally well in a pool worker.
+    """
+    segregated_tree, cycleway_tree = _trees or load_cycleway_trees()
+    road_count = 0
+    results = []
+    for road in roads.iterator(chunk_size=500):
+        road_count += 1
+        red, yellow = compute_road(road.geometry, segregated_tree, cycleway_tree)
+        if red is not None or yellow is not None:
+            results.append((road.pk, road.name, red, yellow))
+    return road_count, results
+
+
+def process_partition(bounds):
+    """
+    Compute the Red and Yellow parts of the roads in a primary key range.
+    """
+    return process_roads(CountyRoad.objects.filter(pk__range=bounds))
+
+
+def affected_roads(changes):
+    """
+    Return the roads whose geometry intersects the envelope of any recorded cycleway change,
+    the only roads whose Red and Yellow parts can differ from the last calculation.
+    """
+    envelopes = [change.geometry for change in changes]
+    if not envelopes:
+        return CountyRoad.objects.none()
+    # The envelopes are merged first so each road is matched once through the spatial index
+    area = GeometryCollection(*envelopes, srid=envelopes[0].srid).unary_union
+    return CountyRoad.objects.filter(geometry__intersects=area)
+
+
+def compute_in_database():
+    """
+    Fill the Red and Yellow tables straight from the roads and cycleways in PostGIS, without
+    moving any geometry through Python. The caller clears the tables and owns the transaction.
+    """
+    quote = connection.ops.quote_name
+    sql = MISSING_INFRASTRUCTURE_SQL.format(
+        road=quote(CountyRoad._meta.db_table),
+        sdcc=quote(CyclewaysSDCC._meta.db_table),
+        dublin_metro=quote(CyclewaysDublinMetro._meta.db_table),
+        cycleway=quote(CountyCycleway._meta.db_table),
+        yellow=quote(YellowCyclingInfrastructure._meta.db_table),
+        red=quote(RedCyclingInfrastructure._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+    # INSERT ... SELECT bypasses save(), fill the simplified geometry columns in bulk
+    RedCyclingInfrastructure.generalize_all()
+    YellowCyclingInfrastructure.generalize_all()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import weakref
+
+from .feeds import aget_feed, aget_snapshot, diff_features
+
+# Seconds between checks of the shared cache for a new feed snapshot
+WATCH_INTERVAL = 1
+
+# Seconds of silence after which a comment is sent to keep idle connections open
+KEEPALIVE_INTERVAL = 15
+
+# Events buffered per client before a slow client is resynchronised with a full snapshot
+SUBSCRIBER_QUEUE_SIZE = 16
+
+# Broadcasters of the feeds per event loop
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def format_event(event, data):
+    """
+    Encode a Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class FeedBroadcaster:
+    """
+    Watches the cached snapshot of one feed and fans every change out to the connected clients.
+
+    Clients never trigger upstream calls of their own: a single watcher per feed and process
+    reads the shared snapshot, diffs it once and pushes the encoded delta to every queue.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.queues = set()
+        self.task = None
+        self.snapshot = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.queues.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.watch())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.queues.discard(queue)
+
+    def publish(self, event):
+        for queue in self.queues:
+            if queue.full():
+                # The client fell behind, replace its backlog with the current state
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(format_event('snapshot', self.snapshot))
+            else:
+                queue.put_nowait(event)
+
+    async def watch(self):
+        fetched_at = None
+        while self.queues:
+            entry = await aget_snapshot(self.name)
+            if entry is not None and entry['fetched_at'] != fetched_at:
+                previous, self.snapshot = self.snapshot, entry['data']
+                fetched_at = entry['fetched_at']
+                if previous is not None:
+                    delta = diff_features(self.name, previous['features'], self.snapshot['features'])
+                    if any(delta.values()):
+                        self.publish(format_event('delta', delta))
+            await asyncio.sleep(WATCH_INTERVAL)
+
+
+def get_broadcaster(name):
+    """
+    Return the broadcaster of a feed on the running event loop.
+    """
+    broadcasters = _broadcasters.setdefault(asyncio.get_running_loop(), {})
+    if name not in broadcasters:
+        broadcasters[name] = FeedBroadcaster(name)
+    return broadcasters[name]
+
+
+async def event_stream(name):
+    """
+    Yield a full snapshot of a feed followed by a delta event for every change.
+    """
+    broadcaster = get_broadcaster(name)
+    queue = broadcaster.subscribe()
+    try:
+        snapshot = await aget_feed(name)
+        if 'error' in snapshot.data:
+            yield format_event('error', snapshot.data)
+            return
+        yield format_event('snapshot', snapshot.data)
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+    finally:
+        broadcaster.unsubscribe(queue)
@@ -1,5 +1,13 @@
+import hashlib
+import io
+import multiprocessing
+import time
+from functools import partial
 from pathlib import Path
+from django.contrib.gis.gdal import DataSource
 from django.contrib.gis.utils import LayerMapping
+from django.db import connection, connections, models, transaction
+from map.signals import MODEL_LAYERS, bulk_delete, deferred_invalidation, schedule_invalidation
 from map.models import( 
 BicycleMaintenanceStandSDCC, 
 BicycleParkingStandSDCC, 
@@ -8,6 +16,7 @@ BikeMaintenanceStandDLR,
 CyclewaysSDCC,
 CyclewaysDublinMetro,
 DublinCityParkingStand,
+LoadedDataset,
 RedCyclingInfrastructure,
 YellowCyclingInfrastructure
 )
@@ -25,10 +34,14 @@ class CustomLayerMapping(LayerMapping):
                 kwargs[key] = ""
         return kwargs
 
-# Mapping for each dataset that is utilised in this application
+# Mapping for each dataset that is utilised in this application.
+# 'key' is the natural key a changed file is upserted by; datasets without one are replaced.
+# 'seed_only' datasets are computed by calculate_missing_infra and only loaded from their
+# exports into an empty table: the exports carry no road links and must never replace results.
 datasets = [
     {
         'model': BicycleMaintenanceStandSDCC,
+        'key': 'featureID',
         'geojson_path':  Path(__file__).resolve().parent / 'data' / 'Bicycle_Maintenance_Stands_SDCC.geojson',
         'mapping': {
                 'featureID': 'OBJECTID',
@@ -42,6 +55,7 @@ datasets = [
     },
     {
         'model': BicycleParkingStandSDCC,
+        'key': 'featureID',
         'geojson_path':  Path(__file__).resolve().parent / 'data' / 'Bicycle_Parking_Stands_SDCC.geojson',
         'mapping': {
                 'featureID': 'FID',
@@ -56,6 +70,7 @@ datasets = [
     },
     {
         'model': BikeMaintenanceStandFCC,
+        'key': 'featureID',
         'geojson_path':  Path(__file__).resolve().parent / 'data' / 'Bike_Maintenance_Stands_2020_2021_2022_FCC.geojson',
         'mapping': {
                 'featureID': 'OBJECTID',
@@ -71,6 +86,7 @@ datasets = [
     },
     {
         'model': BikeMaintenanceStandDLR,
+        'key': 'featureID',
         'geojson_path':  Path(__file__).resolve().parent / 'data' / 'dlr-bicycle-maintenance-stands.json',
         'mapping': {
                 'featureID': 'OBJECTID',
@@ -83,6 +99,7 @@ datasets = [
     },
     {
         'model': CyclewaysSDCC,
+        'key': 'featureID',
         'geojson_path': Path(__file__).resolve().parent / 'data' / 'SDCC_Cycleways_-1477972845665274852.geojson',
         'mapping': {
             'featureID': 'OBJECTID',
@@ -108,6 +125,7 @@ datasets = [
     },
     {
         'model': DublinCityParkingStand,
+        'key': 'osm_id',
         'geojson_path': Path(__file__).resolve().parent / 'data' / 'dublin-city-parking-stands.geojson',
         'mapping': {
             'osm_id': '@id',
@@ -122,6 +140,7 @@ datasets = [
     },
     {
         'model': RedCyclingInfrastructure,
+        'seed_only': True,
         'geojson_path': Path(__file__).resolve().parent / 'exports' / 'red_infrastructure.geojson',
         'mapping': {
             'name': 'name',
@@ -130,6 +149,7 @@ datasets = [
     },
     {
         'model': YellowCyclingInfrastructure,
+        'seed_only': True,
         'geojson_path': Path(__file__).resolve().parent / 'exports' / 'yellow_infrastructure.geojson',
         'mapping': {
             'name': 'name',
@@ -139,12 +159,255 @@ datasets = [
     
 ]
 
-def run(verbose=True):
+# Number of features per COPY batch in bulk mode
+COPY_BATCH_SIZE = 5000
+
+
+def copy_value(value):
+    """
+    Format a value for the PostgreSQL COPY text format, escaping the delimiter characters.
+    """
+    if value is None:
+        return r'\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def feature_rows(model, geojson_path, mapping):
+    """
+    Stream the features of a GeoJSON file as COPY column lists, with the geometry as hex EWKB.
+    Like CustomLayerMapping, missing text values are stored as empty strings and Z
+    coordinates are dropped for 2D geometry columns.
+    """
+    fields = [model._meta.get_field(name) for name in mapping]
+    layer = DataSource(str(geojson_path))[0]
+    for feature in layer:
+        row = []
+        for field in fields:
+            if isinstance(field, models.GeometryField):
+                geometry = feature.geom
+                if field.dim == 2:
+                    # Drop Z like LayerMapping does, 2D columns reject 3D EWKB
+                    geometry.set_3d(False)
+                geometry = geometry.geos
+                geometry.srid = field.srid
+                # Single geometries go into Multi* columns the way LayerMapping does
+                if field.geom_class and geometry.geom_type != field.geom_class.__name__:
+                    geometry = field.geom_class(geometry, srid=field.srid)
+                row.append(geometry.hexewkb.decode())
+            else:
+                value = feature.get(mapping[field.name])
+                if value is None and isinstance(field, (models.CharField, models.TextField)):
+                    value = ''
+                row.append(value)
+        yield row
+
+
+def copy_rows(cursor, table, columns, rows):
+    """
+    Load a batch of rows into a table with COPY FROM STDIN.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def copy_features(cursor, table, columns, rows, batch_size=COPY_BATCH_SIZE):
+    """
+    COPY an iterable of rows into a table in batches and return the number of rows copied.
+    """
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            copy_rows(cursor, table, columns, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        copy_rows(cursor, table, columns, batch)
+        count += len(batch)
+    return count
+
+
+def merge_staging(cursor, table, staging, columns, key):
+    """
+    Make a table match a staging table on a natural key column: delete the rows missing
+    from the staging table, update the rows that differ and insert the new ones. Unchanged
+    rows keep their primary keys. Returns the (inserted, updated, deleted) row counts.
+    """
+    column_list = ', '.join(columns)
+    staged_list = ', '.join(f's.{column}' for column in columns)
+    cursor.execute(
+        f"DELETE FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.{key} = t.{key})"
+    )
+    deleted = cursor.rowcount
+    cursor.execute(
+        f"UPDATE {table} t SET ({column_list}) = ({staged_list}) FROM {staging} s "
+        f"WHERE s.{key} = t.{key} AND ({', '.join(f't.{column}' for column in columns)}) IS DISTINCT FROM ({staged_list})"
+    )
+    updated = cursor.rowcount
+    cursor.execute(
+        f"INSERT INTO {table} ({column_list}) SELECT {staged_list} FROM {staging} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = s.{key})"
+    )
+    inserted = cursor.rowcount
+    return inserted, updated, deleted
+
+
+def bulk_load(model, geojson_path, mapping, key=None, batch_size=COPY_BATCH_SIZE):
+    """
+    Load a GeoJSON file with PostgreSQL COPY in batches, in a single transaction,
+    and return the number of features read.
+
+    Without a natural key the features are appended to the table. With one, they are
+    copied into a temporary staging table and upserted by that key, removing rows no
+    longer in the file. Bypasses save(), so the simplified geometry columns are filled
+    afterwards and the cached layers built from the model are dropped.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = [quote(model._meta.get_field(name).column) for name in mapping]
+    rows = feature_rows(model, geojson_path, mapping)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if key is None:
+            count = copy_features(cursor, table, columns, rows, batch_size)
+        else:
+            staging = quote(f'{model._meta.db_table}_staging')
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+            )
+            count = copy_features(cursor, staging, columns, rows, batch_size)
+            inserted, updated, deleted = merge_staging(
+                cursor, table, staging, columns, quote(model._meta.get_field(key).column)
+            )
+            print(f"{model.__name__}: {inserted} inserted, {updated} updated, {deleted} deleted")
+
+        if hasattr(model, 'generalize_all'):
+            model.generalize_all()
+
+    # COPY sends no signals, bump the layers of the model once the load commits
+    for layer in MODEL_LAYERS.get(model, ()):
+        schedule_invalidation(layer)
+    return count
+
+
+def content_hash(path):
+    """
+    Return the SHA-256 hex digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sync_dataset(dataset):
+    """
+    Reload a dataset only when its file changed since it was last loaded, upserting it by
+    its natural key, or replacing the whole table when it has none, and record the new
+    content hash and feature count in the dataset registry. Cycleway changes are
+    recorded by the table triggers for incremental Red/Yellow recomputation.
+    Returns True when the dataset was reloaded.
+    """
+    model = dataset['model']
+    path = dataset['geojson_path']
+    if not Path(path).exists():
+        print(f"Skipping {model.__name__}: {path} does not exist")
+        return False
+
+    if dataset.get('seed_only') and model.objects.exists():
+        print(f"Skipping {model.__name__}: computed by calculate_missing_infra, only loaded into an empty table")
+        return False
+
+    digest = content_hash(path)
+    registry = LoadedDataset.objects.filter(name=model.__name__).first()
+    if registry is not None and registry.content_hash == digest:
+        print(f"Skipping {model.__name__}: unchanged since {registry.loaded_at:%Y-%m-%d %H:%M}")
+        return False
+
+    started = time.monotonic()
+    with transaction.atomic(), deferred_invalidation():
+        key = dataset.get('key')
+        if key is None:
+            bulk_delete(model.objects.all())
+        count = bulk_load(model, path, dataset['mapping'], key=key)
+        registry = registry or LoadedDataset(name=model.__name__)
+        registry.content_hash = digest
+        registry.feature_count = count
+        registry.save()
+    print(f"Loaded {count} features into {model.__name__} in {time.monotonic() - started:.2f}s")
+    return True
+
+
+def load_dataset(dataset, bulk=False, verbose=True, layer_mapping=CustomLayerMapping):
+    """
+    Load one dataset, with COPY in bulk mode or feature by feature through LayerMapping.
+    """
+    model = dataset['model']
+    if bulk:
+        started = time.monotonic()
+        count = bulk_load(model, dataset['geojson_path'], dataset['mapping'])
+        elapsed = time.monotonic() - started
+        print(f"Copied {count} rows into {model.__name__} in {elapsed:.2f}s ({count / max(elapsed, 1e-6):.0f} rows/sec)")
+    else:
+        lm = layer_mapping(model, dataset['geojson_path'], dataset['mapping'], transform=False)
+        with deferred_invalidation():
+            lm.save(strict=True, verbose=verbose)
+
+
+def timed_load(function, dataset):
+    """
+    Apply a load function to a dataset and return the model name with the elapsed seconds.
+    """
+    name = dataset['model'].__name__
+    print(f"Loading data for {name}...")
+    started = time.monotonic()
+    function(dataset)
+    return name, time.monotonic() - started
+
+
+def load_all(function, datasets, parallel=1):
+    """
+    Apply a load function to every dataset, printing the time each one took.
+
+    The datasets target separate tables, so with parallel > 1 they are loaded concurrently
+    in a pool of forked worker processes, each opening its own database connection.
+    """
+    if parallel <= 1:
+        results = (timed_load(function, dataset) for dataset in datasets)
+        for name, elapsed in results:
+            print(f"Data loaded for {name} in {elapsed:.2f}s")
+        return
+
+    # Forked workers must not share the parent's database connection
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(parallel) as pool:
+        for name, elapsed in pool.imap_unordered(partial(timed_load, function), datasets):
+            print(f"Data loaded for {name} in {elapsed:.2f}s")
+
+
+def run(verbose=True, bulk=False, parallel=1):
     """
     Load data from GeoJSON files into the database.
+    With bulk=True each dataset is streamed in with PostgreSQL COPY instead of saved feature by feature,
+    with parallel > 1 that many datasets are loaded at once.
+    """
+    load_all(partial(load_dataset, bulk=bulk, verbose=verbose), datasets, parallel)
+
+
+def sync(parallel=1):
+    """
+    Bring the database in line with the GeoJSON files, reloading only the datasets whose content changed.
     """
-    for dataset in datasets:
-        print(f"Loading data for {dataset['model'].__name__}...")
-        lm = CustomLayerMapping(dataset['model'], dataset['geojson_path'], dataset['mapping'], transform=False)
-        lm.save(strict=True, verbose=verbose)
-        print(f"Data loaded for {dataset['model'].__name__}")
\ No newline at end of file
+    load_all(sync_dataset, datasets, parallel)
@@ -1,17 +1,25 @@
 import os
 import logging
-from django.core.management.base import BaseCommand
-from django.contrib.gis.geos import MultiLineString, GEOSGeometry
-from django.contrib.gis.db.models.functions import Difference
+import multiprocessing
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
 from django.core.serializers import serialize
 from map.models import (
     CountyRoad,
-    CountyCycleway,
-    CyclewaysSDCC,
-    CyclewaysDublinMetro,
+    CyclewayChange,
     RedCyclingInfrastructure,
     YellowCyclingInfrastructure,
 )
+from map.cache import invalidate_layer
+from map.signals import bulk_delete, deferred_invalidation
+from map.infrastructure import (
+    affected_roads,
+    compute_in_database,
+    load_cycleway_trees,
+    partition_roads,
+    process_partition,
+    process_roads,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,65 +28,170 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = "Calculate and store roads with no cycling infrastructure (Red) and non-segregated cycling infrastructure (Yellow), and dump to GeoJSON."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Number of worker processes computing road partitions in parallel.",
+        )
+        parser.add_argument(
+            '--engine',
+            choices=['python', 'sql'],
+            default='python',
+            help="Compute geometries in Python with GEOS, or entirely inside PostGIS.",
+        )
+        parser.add_argument(
+            '--partition-size',
+            type=int,
+            default=500,
+            help="Number of roads per primary key range handed to a worker.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of rows per INSERT when storing the results.",
+        )
+        parser.add_argument(
+            '--output-dir',
+            default=os.path.join('map', 'exports'),
+            help="Directory the Red and Yellow GeoJSON dumps are written to.",
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help="Only recompute the roads touched by cycleway changes since the last calculation (Python engine).",
+        )
+
+    def run_partitions(self, partitions, workers):
+        """
+        Yield (road count, results) for every partition, as soon as each one completes.
+        """
+        if workers <= 1:
+            load_cycleway_trees()
+            for bounds in partitions:
+                yield process_partition(bounds)
+            return
+
+        # Forked workers must open their own database connections
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers, initializer=load_cycleway_trees) as pool:
+            yield from pool.imap_unordered(process_partition, partitions)
+
+    def build_objects(self, results, red_objects, yellow_objects):
+        """
+        Turn (road pk, name, red, yellow) results into unsaved Red and Yellow instances.
+        bulk_create bypasses save(), so their simplified geometries are filled here.
+        """
+        for road_id, name, red_geometry, yellow_geometry in results:
+            # Road segments with no cycling infrastructure (Red)
+            if red_geometry is not None:
+                red_objects.append(RedCyclingInfrastructure(road_id=road_id, name=name, geometry=red_geometry))
+                red_objects[-1].generalize()
+
+            # Road segments with non-segregated cycling infrastructure (Yellow)
+            if yellow_geometry is not None:
+                yellow_objects.append(YellowCyclingInfrastructure(road_id=road_id, name=name, geometry=yellow_geometry))
+                yellow_objects[-1].generalize()
+
+    def compute_in_python(self, workers, partition_size):
+        """
+        Compute the Red and Yellow parts of every road with GEOS, buffered as unsaved model instances.
+        """
+        red_objects = []
+        yellow_objects = []
+
+        # Process the public roads in primary key ranges, in a pool of worker processes
+        # when asked to; every process indexes the cycleways once for all its ranges
+        total_roads = CountyRoad.objects.count()
+        partitions = partition_roads(partition_size)
+        processed = 0
+        for road_count, results in self.run_partitions(partitions, workers):
+            self.build_objects(results, red_objects, yellow_objects)
+
+            # Log progress across all workers
+            processed += road_count
+            logger.info(f"Processed {processed}/{total_roads} roads")
+
+        return red_objects, yellow_objects
+
+    def replace_results(self, red_objects, yellow_objects, batch_size):
+        """
+        Swap in the new Red and Yellow rows in a single transaction, so readers keep
+        seeing the previous layers until the new ones are complete.
+        """
+        with transaction.atomic():
+            bulk_delete(RedCyclingInfrastructure.objects.all())
+            bulk_delete(YellowCyclingInfrastructure.objects.all())
+            RedCyclingInfrastructure.objects.bulk_create(red_objects, batch_size=batch_size)
+            YellowCyclingInfrastructure.objects.bulk_create(yellow_objects, batch_size=batch_size)
+        logger.info(f"Stored {len(red_objects)} Red and {len(yellow_objects)} Yellow rows")
+
+    def update_incremental(self, batch_size):
+        """
+        Recompute only the roads touched by the recorded cycleway changes, replacing their
+        Red and Yellow rows and consuming the processed changes in the same transaction.
+        """
+        if (RedCyclingInfrastructure.objects.filter(road__isnull=True).exists()
+                or YellowCyclingInfrastructure.objects.filter(road__isnull=True).exists()):
+            raise CommandError("Red/Yellow rows are not linked to their roads, run a full calculation first.")
+
+        changes = list(CyclewayChange.objects.order_by('pk'))
+        if not changes:
+            logger.info("No cycleway changes since the last calculation")
+            return
+
+        roads = affected_roads(changes)
+        road_ids = list(roads.values_list('pk', flat=True))
+        load_cycleway_trees()
+        road_count, results = process_roads(CountyRoad.objects.filter(pk__in=road_ids))
+        red_objects = []
+        yellow_objects = []
+        self.build_objects(results, red_objects, yellow_objects)
+
+        with transaction.atomic():
+            bulk_delete(RedCyclingInfrastructure.objects.filter(road_id__in=road_ids))
+            bulk_delete(YellowCyclingInfrastructure.objects.filter(road_id__in=road_ids))
+            RedCyclingInfrastructure.objects.bulk_create(red_objects, batch_size=batch_size)
+            YellowCyclingInfrastructure.objects.bulk_create(yellow_objects, batch_size=batch_size)
+            CyclewayChange.objects.filter(pk__lte=changes[-1].pk).delete()
+        logger.info(f"Recomputed {road_count} roads for {len(changes)} cycleway changes")
+
     def handle(self, *args, **options):
         self.stdout.write("Calculating missing and non-segregated cycling infrastructure...")
         logger.info("Starting calculation of missing and non-segregated cycling infrastructure...")
 
-        # Clear previous results
-        RedCyclingInfrastructure.objects.all().delete()
-        YellowCyclingInfrastructure.objects.all().delete()
-
-        # Load geometries for both segregated cycleway models
-        sdcc_geometries = CyclewaysSDCC.objects.values_list('geometry', flat=True)
-        dublin_metro_geometries = CyclewaysDublinMetro.objects.values_list('geometry', flat=True)
-        
-        # Combine all segregated geometries
-        segregated_geometries = list(sdcc_geometries) + list(dublin_metro_geometries)
-
-        # Load all non-segregated cycleway geometries
-        cycleway_geometries = CountyCycleway.objects.values_list('geometry', flat=True)
-
-        # Process each public road
-        total_roads = CountyRoad.objects.count()
-        for index, road in enumerate(CountyRoad.objects.iterator(chunk_size=500)):
-            road_geometry = road.geometry
-
-            # Step 1: Subtract all segregated infrastructure
-            for segregated in segregated_geometries:
-                road_geometry = road_geometry.difference(segregated)
-
-            # Step 2: Subtract non-segregated cycleways (remaining is Red)
-            nonsegmented_geometry = road_geometry  # Save intermediate result for Yellow
-            for cycleway in cycleway_geometries:
-                road_geometry = road_geometry.difference(cycleway)
-
-            # Save the road segments with no cycling infrastructure (Red)
-            if not road_geometry.empty:
-                if road_geometry.geom_type == 'LineString':  # Wrap LineString as MultiLineString
-                    road_geometry = MultiLineString(road_geometry)
-                RedCyclingInfrastructure.objects.create(
-                    name=road.name,
-                    geometry=road_geometry
-                )
-
-            # Save road segments with non-segregated cycling infrastructure (Yellow)
-            if not nonsegmented_geometry.empty:
-                if nonsegmented_geometry.geom_type == 'LineString':  # Wrap LineString as MultiLineString
-                    nonsegmented_geometry = MultiLineString(nonsegmented_geometry)
-                YellowCyclingInfrastructure.objects.create(
-                    name=road.name,
-                    geometry=nonsegmented_geometry
-                )
-
-            # Log progress
-            if (index + 1) % 100 == 0:
-                logger.info(f"Processed {index + 1}/{total_roads} roads")
+        # Changes recorded before this point are covered by a full calculation
+        last_change = CyclewayChange.objects.order_by('-pk').values_list('pk', flat=True).first()
+
+        # Row deletes send one signal each, bump the layers once for the whole run
+        with deferred_invalidation():
+            if options['incremental']:
+                self.update_incremental(options['batch_size'])
+            elif options['engine'] == 'sql':
+                # Clear previous results and recompute both layers in one transaction
+                with transaction.atomic():
+                    bulk_delete(RedCyclingInfrastructure.objects.all())
+                    bulk_delete(YellowCyclingInfrastructure.objects.all())
+                    compute_in_database()
+                logger.info("Computed Red and Yellow infrastructure inside PostGIS")
+            else:
+                red_objects, yellow_objects = self.compute_in_python(options['workers'], options['partition_size'])
+                self.replace_results(red_objects, yellow_objects, options['batch_size'])
+
+        if last_change is not None and not options['incremental']:
+            CyclewayChange.objects.filter(pk__lte=last_change).delete()
+
+        # bulk_create and INSERT ... SELECT send no signals, bump the layers explicitly
+        invalidate_layer('red')
+        invalidate_layer('yellow')
 
         self.stdout.write(self.style.SUCCESS("Successfully calculated Red and Yellow infrastructure."))
         logger.info("Successfully calculated Red and Yellow infrastructure.")
 
         # Dump results to GeoJSON files
-        output_dir = os.path.join(os.getcwd(), 'map', 'exports')
+        output_dir = os.path.abspath(options['output_dir'])
         os.makedirs(output_dir, exist_ok=True)
 
         # Dump Red infrastructure
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from map import load
+
+
+class Command(BaseCommand):
+    help = "Load the application's GeoJSON datasets into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=1,
+            help="Number of datasets loaded concurrently in separate worker processes.",
+        )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help="Stream the features in with PostgreSQL COPY instead of saving them one at a time.",
+        )
+        parser.add_argument(
+            '--changed-only',
+            action='store_true',
+            help="Only reload the datasets whose file content changed since they were last loaded.",
+        )
+
+    def handle(self, *args, **options):
+        if options['changed_only']:
+            load.sync(parallel=options['parallel'])
+        else:
+            load.run(bulk=options['bulk'], parallel=options['parallel'])
+        self.stdout.write(self.style.SUCCESS("Data loaded successfully."))
@@ -1,11 +1,26 @@
 from django.core.management.base import BaseCommand
 from django.contrib.gis.utils import LayerMapping
 from map.models import CountyRoad, CountyCycleway
+from map.load import load_all, load_dataset
+from functools import partial
 from pathlib import Path
 
 class Command(BaseCommand):
     help = "Load normalized GeoJSON files into the database."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help="Stream the features in with PostgreSQL COPY instead of saving them one at a time.",
+        )
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=1,
+            help="Number of datasets loaded concurrently in separate worker processes.",
+        )
+
     def handle(self, *args, **options):
         base_path = Path(__file__).resolve().parent.parent.parent / 'data'
 
@@ -22,8 +37,5 @@ class Command(BaseCommand):
             }
         ]
 
-        for dataset in datasets:
-            print(f"Loading {dataset['geojson_path']}...")
-            lm = LayerMapping(dataset['model'], dataset['geojson_path'], dataset['mapping'], transform=False)
-            lm.save(strict=True, verbose=True)
+        load_all(partial(load_dataset, bulk=options['bulk'], layer_mapping=LayerMapping), datasets, options['parallel'])
         print("Data loaded successfully.")
\ No newline at end of file
@@ -0,0 +1,71 @@
+import time
+import logging
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from map.feeds import (
+    FEEDS,
+    POLLER_HEARTBEAT_KEY,
+    feed_ttl,
+    get_health,
+    refresh_feed,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between scheduling rounds of the poller
+TICK = 1
+
+class Command(BaseCommand):
+    help = "Poll the live bike feeds on their TTL schedule and keep their last good snapshots in the shared cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--feed',
+            action='append',
+            choices=sorted(FEEDS),
+            help="Feed to poll, can be repeated. Defaults to every feed.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Refresh every feed once and exit.",
+        )
+
+    def poll(self, name):
+        """
+        Refresh one feed and return when it is next due.
+        """
+        data = refresh_feed(name)
+        if 'error' in data:
+            health = get_health(name)
+            logger.warning(f"{name}: {data['error']} ({health['failures']} consecutive failures)")
+            # Retry when the breaker closes, or on the normal schedule until it opens
+            return max(health['open_until'], time.time() + feed_ttl(name))
+        logger.info(f"{name}: {len(data.get('features', []))} features")
+        return time.time() + feed_ttl(name)
+
+    def handle(self, *args, **options):
+        names = options['feed'] or list(FEEDS)
+        if options['once']:
+            failed = [name for name in names if 'error' in refresh_feed(name)]
+            if failed:
+                raise CommandError(f"Failed to refresh {', '.join(failed)}")
+            return
+
+        if isinstance(caches['default'], LocMemCache):
+            # The workers would never see the snapshots or the heartbeat of this process
+            raise CommandError("Polling needs a cache shared with the workers, set REDIS_URL")
+
+        self.stdout.write(f"Polling {', '.join(names)}...")
+        due = dict.fromkeys(names, 0)
+        while True:
+            # The heartbeat outlives a few missed ticks, so request handlers only take
+            # over refreshing when the poller is really gone
+            for name in names:
+                cache.set(POLLER_HEARTBEAT_KEY.format(name=name), time.time(), timeout=feed_ttl(name) * 2)
+                if time.time() >= due[name]:
+                    due[name] = self.poll(name)
+            time.sleep(TICK)
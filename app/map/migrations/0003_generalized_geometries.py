@@ -0,0 +1,71 @@
+# Generated by Django 5.1 on 2026-10-18 10:12
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0002_countycycleway_countyroad_dublincityparkingstand_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cyclewaysdublinmetro',
+            name='geometry_low',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='cyclewaysdublinmetro',
+            name='geometry_mid',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='cyclewayssdcc',
+            name='geometry_low',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='cyclewayssdcc',
+            name='geometry_mid',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='redcyclinginfrastructure',
+            name='geometry_low',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='redcyclinginfrastructure',
+            name='geometry_mid',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='yellowcyclinginfrastructure',
+            name='geometry_low',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='yellowcyclinginfrastructure',
+            name='geometry_mid',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE map_cyclewaysdublinmetro SET
+                    geometry_low = ST_SimplifyPreserveTopology(geometry, 0.0003),
+                    geometry_mid = ST_SimplifyPreserveTopology(geometry, 0.00004);
+                UPDATE map_cyclewayssdcc SET
+                    geometry_low = ST_SimplifyPreserveTopology(geometry, 0.0003),
+                    geometry_mid = ST_SimplifyPreserveTopology(geometry, 0.00004);
+                UPDATE map_redcyclinginfrastructure SET
+                    geometry_low = ST_SimplifyPreserveTopology(geometry, 0.0003),
+                    geometry_mid = ST_SimplifyPreserveTopology(geometry, 0.00004);
+                UPDATE map_yellowcyclinginfrastructure SET
+                    geometry_low = ST_SimplifyPreserveTopology(geometry, 0.0003),
+                    geometry_mid = ST_SimplifyPreserveTopology(geometry, 0.00004);
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-18 11:40
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0003_generalized_geometries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CyclewayChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geometry', django.contrib.gis.db.models.fields.GeometryField(srid=4326)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='redcyclinginfrastructure',
+            name='road',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='map.countyroad'),
+        ),
+        migrations.AddField(
+            model_name='yellowcyclinginfrastructure',
+            name='road',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='map.countyroad'),
+        ),
+    ]
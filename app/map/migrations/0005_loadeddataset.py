@@ -0,0 +1,24 @@
+# Generated by Django 5.1 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0004_cyclewaychange_red_yellow_road'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadedDataset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('feature_count', models.IntegerField(default=0)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('loaded_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
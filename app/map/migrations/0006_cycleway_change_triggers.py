@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# Cycleway tables whose changes are recorded, with the primary key column that pairs the
+# old and new versions of updated rows
+TRACKED_TABLES = (
+    ('map_cyclewayssdcc', 'id'),
+    ('map_cyclewaysdublinmetro', 'featureID'),
+    ('map_countycycleway', 'id'),
+)
+
+# Records the envelope of every cycleway geometry inserted, deleted or changed by an update,
+# whoever writes it: instance saves, queryset updates and deletes, COPY loads or raw SQL.
+# Statement-level triggers read the affected rows from transition tables, so bulk writes
+# record their changes in one INSERT ... SELECT.
+CREATE_FUNCTION = """
+    CREATE FUNCTION map_record_cycleway_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO map_cyclewaychange (geometry, created_at)
+            SELECT ST_Envelope(geometry), now() FROM new_rows WHERE NOT ST_IsEmpty(geometry);
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO map_cyclewaychange (geometry, created_at)
+            SELECT ST_Envelope(geometry), now() FROM old_rows WHERE NOT ST_IsEmpty(geometry);
+        ELSE
+            -- Updates of other columns, e.g. the simplified geometries, are not changes
+            EXECUTE format(
+                'INSERT INTO map_cyclewaychange (geometry, created_at) '
+                'SELECT ST_Envelope(changed.geometry), now() '
+                'FROM old_rows o JOIN new_rows n USING (%1$I), '
+                'LATERAL (VALUES (o.geometry), (n.geometry)) AS changed(geometry) '
+                'WHERE o.geometry IS DISTINCT FROM n.geometry AND NOT ST_IsEmpty(changed.geometry)',
+                TG_ARGV[0]
+            );
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGERS = """
+    CREATE TRIGGER {table}_insert_change AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION map_record_cycleway_change('{pk}');
+    CREATE TRIGGER {table}_update_change AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION map_record_cycleway_change('{pk}');
+    CREATE TRIGGER {table}_delete_change AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION map_record_cycleway_change('{pk}');
+"""
+
+DROP_TRIGGERS = """
+    DROP TRIGGER {table}_insert_change ON {table};
+    DROP TRIGGER {table}_update_change ON {table};
+    DROP TRIGGER {table}_delete_change ON {table};
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0005_loadeddataset'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_FUNCTION, 'DROP FUNCTION map_record_cycleway_change();'),
+    ] + [
+        migrations.RunSQL(
+            CREATE_TRIGGERS.format(table=table, pk=pk),
+            DROP_TRIGGERS.format(table=table),
+        )
+        for table, pk in TRACKED_TABLES
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0006_cycleway_change_triggers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LayerVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('layer', models.CharField(max_length=100, unique=True)),
+                ('version', models.BigIntegerField()),
+                ('modified_at', models.DateTimeField()),
+            ],
+        ),
+    ]
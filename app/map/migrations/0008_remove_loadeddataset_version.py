@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 17:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('map', '0007_layerversion'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='loadeddataset',
+            name='version',
+        ),
+    ]
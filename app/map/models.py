@@ -1,10 +1,42 @@
 from django.contrib.gis.db import models
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from .generalization import GENERALIZATION_BANDS, SimplifyPreserveTopology
 
 # Model definitions for each of the data sets that will be used in this application.
 
 
+class GeneralizedGeometryModel(models.Model):
+    """Abstract model for line layers keeping simplified copies of their geometry per zoom band.
+    """
+    geometry_low = models.GeometryField(null=True, blank=True)
+    geometry_mid = models.GeometryField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    def generalize(self):
+        """
+        Fill the simplified geometry columns from the full resolution geometry.
+        """
+        for _, field, tolerance in GENERALIZATION_BANDS:
+            setattr(self, field, self.geometry.simplify(tolerance, preserve_topology=True))
+
+    @classmethod
+    def generalize_all(cls, queryset=None):
+        """
+        Recompute the simplified geometry columns in the database, for bulk paths that bypass save().
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        queryset.update(**{
+            field: SimplifyPreserveTopology('geometry', tolerance)
+            for _, field, tolerance in GENERALIZATION_BANDS
+        })
+
+    def save(self, *args, **kwargs):
+        self.generalize()
+        super().save(*args, **kwargs)
+
+
 class BicycleMaintenanceStandSDCC(models.Model):
     """Model definition for Bicycle maintenance stands from South Dublin County Council.
     """
@@ -86,7 +118,7 @@ class BikeMaintenanceStandDLR(models.Model):
         return f"{self.featureID} - {self.covered} - {self.confirmed}"
 
 
-class CyclewaysSDCC(models.Model):
+class CyclewaysSDCC(GeneralizedGeometryModel):
     """Model definition for Cycleways from South Dublin County Council.
     """
     featureID = models.IntegerField()
@@ -97,20 +129,12 @@ class CyclewaysSDCC(models.Model):
     refname = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     geometry = models.LineStringField()
-  
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete('cycleways_geojson')
-
-    def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        cache.delete('cycleways_geojson')  
 
     def __str__(self):
         return f"{self.featureID} - {self.name}"
 
     
-class CyclewaysDublinMetro(models.Model):
+class CyclewaysDublinMetro(GeneralizedGeometryModel):
     """Model definition for Cycleways for Dublin Metropolitan area.
     """
     # No feature id in data set, auto incrementing id will be used.
@@ -121,31 +145,27 @@ class CyclewaysDublinMetro(models.Model):
     shape_length = models.CharField(max_length=255)
     geometry = models.LineStringField()
     
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete('cycleways_geojson')
-
-    def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        cache.delete('cycleways_geojson')
-    
     def __str__(self):
         return f"{self.featureID} - {self.name} - {self.twoway} - {self.bollard_protected}"
 
-class YellowCyclingInfrastructure(models.Model):
+class YellowCyclingInfrastructure(GeneralizedGeometryModel):
     """Model definition for Yellow Cycling Infrastructure - Non segregated - Dublin County.
     """
     name = models.CharField(max_length=255, null=True, blank=True)
     geometry = models.MultiLineStringField()
+    # Road the row was computed from, used by incremental recomputation
+    road = models.ForeignKey('CountyRoad', null=True, blank=True, on_delete=models.SET_NULL)
     
     def __str__(self):
         return f"{self.name or 'Unnamed'}"
     
-class RedCyclingInfrastructure(models.Model):
+class RedCyclingInfrastructure(GeneralizedGeometryModel):
     """Model definition for Red Cycling Infrastructure - No cycling infrastructure - Dublin County.
     """
     name = models.CharField(max_length=255, null=True, blank=True)
     geometry = models.MultiLineStringField()
+    # Road the row was computed from, used by incremental recomputation
+    road = models.ForeignKey('CountyRoad', null=True, blank=True, on_delete=models.SET_NULL)
     
     def __str__(self):
         return f"{self.name or 'Unnamed'}"
@@ -173,8 +193,51 @@ class CountyCycleway(models.Model):
 
     def __str__(self):
         return self.name or "Unnamed Cycleway"
+
+
+class CyclewayChange(models.Model):
+    """
+    Envelope of a cycleway geometry added, edited or removed since the last Red/Yellow calculation.
+
+    Rows are written by database triggers on the CyclewaysSDCC, CyclewaysDublinMetro and
+    CountyCycleway tables (migration 0006), so every writer is recorded, including queryset
+    updates and deletes, COPY loads and raw SQL.
+
+    Note: Development model only used to calculate differences.
+    """
+    geometry = models.GeometryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Change {self.pk} at {self.created_at}"
+
+
+class LoadedDataset(models.Model):
+    """
+    Registry of the GeoJSON datasets loaded into the database, used to skip reloading unchanged files.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    content_hash = models.CharField(max_length=64)
+    feature_count = models.IntegerField(default=0)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.feature_count} features)"
     
 
+class LayerVersion(models.Model):
+    """
+    Current version of a served layer, shared by every worker and process. Artifact files,
+    tile cache keys and ETags all include it, so bumping it invalidates them everywhere.
+    """
+    layer = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField()
+    modified_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.layer} v{self.version}"
+
+
 # # User Profile model
 User = get_user_model()
 
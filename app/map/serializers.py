@@ -14,134 +14,193 @@ from .models import (
 )
 
 
-def serialize_cycleways_sdcc():
+# Properties serialized for each model, shared by the GeoJSON serializers and vector tiles
+MODEL_FIELDS = {
+    CyclewaysSDCC: ['featureID', 'name', 'colour', 'linetype', 'refname', 'description'],
+    CyclewaysDublinMetro: ['featureID', 'name', 'twoway', 'bollard_protected', 'shape_length'],
+    BicycleParkingStandSDCC: ['featureID', 'featureID_internal', 'x', 'y', 'area', 'location'],
+    DublinCityParkingStand: [
+        'osm_id',
+        'bicycle_parking',
+        'covered',
+        'capacity',
+        'surveillance',
+        'website',
+        'fee',
+    ],
+    BicycleMaintenanceStandSDCC: ['featureID', 'featureID_internal', 'x', 'y', 'area', 'location'],
+    BikeMaintenanceStandFCC: [
+        'featureID',
+        'featureID_internal',
+        'location',
+        'area',
+        'public_stands',
+        'private_stands',
+        'date_added',
+        'stand_type',
+    ],
+    BikeMaintenanceStandDLR: ['featureID', 'featureID_internal', 'maintenance_point', 'covered', 'confirmed'],
+    RedCyclingInfrastructure: ['name'],
+    YellowCyclingInfrastructure: ['name'],
+}
+
+# Models making up each map layer
+LAYER_MODELS = {
+    'cycleways': (CyclewaysSDCC, CyclewaysDublinMetro),
+    'red': (RedCyclingInfrastructure,),
+    'yellow': (YellowCyclingInfrastructure,),
+    'parking-stands': (BicycleParkingStandSDCC, DublinCityParkingStand),
+    'maintenance-stands': (BikeMaintenanceStandDLR, BikeMaintenanceStandFCC, BicycleMaintenanceStandSDCC),
+}
+
+
+def filter_bbox(queryset, bbox=None):
+    """
+    Restrict a queryset to features whose bounding box overlaps the given envelope.
+    The `&&` lookup is answered from the spatial index on the geometry column.
+    """
+    if bbox is None:
+        return queryset
+    return queryset.filter(geometry__bboverlaps=bbox)
+
+
+def serialize_cycleways_sdcc(bbox=None, geometry_field='geometry'):
     """
     Serialize CyclewaysSDCC to GeoJSON.
     """
     data = serialize(
         'geojson',
-        CyclewaysSDCC.objects.all(),
-        geometry_field='geometry',
-        fields=['featureID', 'name', 'colour', 'linetype', 'refname', 'description'],
+        filter_bbox(CyclewaysSDCC.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[CyclewaysSDCC],
     )
     return json.loads(data)
 
 
-def serialize_cycleways_dublin_metro():
+def serialize_cycleways_dublin_metro(bbox=None, geometry_field='geometry'):
     """
     Serialize CyclewaysDublinMetro to GeoJSON.
     """
     data = serialize(
         'geojson',
-        CyclewaysDublinMetro.objects.all(),
-        geometry_field='geometry',
-        fields=['featureID', 'name', 'twoway', 'bollard_protected', 'shape_length'],
+        filter_bbox(CyclewaysDublinMetro.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[CyclewaysDublinMetro],
     )
     return json.loads(data)
 
 
-def serialize_bicycle_parking_stands_sdcc():
+def serialize_bicycle_parking_stands_sdcc(bbox=None, geometry_field='geometry'):
     """
     Serialize BicycleParkingStandSDCC to GeoJSON.
     """
     data = serialize(
         'geojson',
-        BicycleParkingStandSDCC.objects.all(),
-        geometry_field='geometry',
-        fields=['featureID', 'featureID_internal', 'x', 'y', 'area', 'location'],
+        filter_bbox(BicycleParkingStandSDCC.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[BicycleParkingStandSDCC],
     )
     return json.loads(data)
 import json
 
-def serialize_dublin_city_parking_stands():
+def serialize_dublin_city_parking_stands(bbox=None, geometry_field='geometry'):
     """
     Serialize DublinCityParkingStand to GeoJSON.
     """
     data = serialize(
         'geojson',
-        DublinCityParkingStand.objects.all(),
-        geometry_field='geometry',
-        fields=[
-            'osm_id',
-            'bicycle_parking',
-            'covered',
-            'capacity',
-            'surveillance',
-            'website',
-            'fee',
-        ],
+        filter_bbox(DublinCityParkingStand.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[DublinCityParkingStand],
     )
     return json.loads(data)
 
-def serialize_bicycle_maintenance_stands_sdcc():
+def serialize_bicycle_maintenance_stands_sdcc(bbox=None, geometry_field='geometry'):
     """
     Serialize BicycleMaintenanceStandSDCC to GeoJSON.
     """
     data = serialize(
         'geojson',
-        BicycleMaintenanceStandSDCC.objects.all(),
-        geometry_field='geometry',
-        fields=['featureID', 'featureID_internal', 'x', 'y', 'area', 'location'],
+        filter_bbox(BicycleMaintenanceStandSDCC.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[BicycleMaintenanceStandSDCC],
     )
     return json.loads(data)
 
 
-def serialize_bike_maintenance_stands_fcc():
+def serialize_bike_maintenance_stands_fcc(bbox=None, geometry_field='geometry'):
     """
     Serialize BikeMaintenanceStandFCC to GeoJSON.
     """
     data = serialize(
         'geojson',
-        BikeMaintenanceStandFCC.objects.all(),
-        geometry_field='geometry',
-        fields=[
-            'featureID',
-            'featureID_internal',
-            'location',
-            'area',
-            'public_stands',
-            'private_stands',
-            'date_added',
-            'stand_type',
-        ],
+        filter_bbox(BikeMaintenanceStandFCC.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[BikeMaintenanceStandFCC],
     )
     return json.loads(data)
 
 
-def serialize_bike_maintenance_stands_dlr():
+def serialize_bike_maintenance_stands_dlr(bbox=None, geometry_field='geometry'):
     """
     Serialize BikeMaintenanceStandDLR to GeoJSON.
     """
     data = serialize(
         'geojson',
-        BikeMaintenanceStandDLR.objects.all(),
-        geometry_field='geometry',
-        fields=['featureID', 'featureID_internal', 'maintenance_point', 'covered', 'confirmed'],
+        filter_bbox(BikeMaintenanceStandDLR.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[BikeMaintenanceStandDLR],
     )
     return json.loads(data)
 
 
-def serialize_red_cycling_infrastructure():
+def serialize_red_cycling_infrastructure(bbox=None, geometry_field='geometry'):
     """
     Serialize RedCyclingInfrastructure to GeoJSON.
     """
     data = serialize(
         'geojson',
-        RedCyclingInfrastructure.objects.all(),
-        geometry_field='geometry',
-        fields=['name'],
+        filter_bbox(RedCyclingInfrastructure.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[RedCyclingInfrastructure],
     )
     return json.loads(data)
 
 
-def serialize_yellow_cycling_infrastructure():
+def serialize_yellow_cycling_infrastructure(bbox=None, geometry_field='geometry'):
     """
     Serialize YellowCyclingInfrastructure to GeoJSON.
     """
     data = serialize(
         'geojson',
-        YellowCyclingInfrastructure.objects.all(),
-        geometry_field='geometry',
-        fields=['name'],
+        filter_bbox(YellowCyclingInfrastructure.objects.all(), bbox),
+        geometry_field=geometry_field,
+        fields=MODEL_FIELDS[YellowCyclingInfrastructure],
     )
-    return json.loads(data)
\ No newline at end of file
+    return json.loads(data)
+
+# Serializers making up each map layer, keyed by layer name
+LAYER_SERIALIZERS = {
+    'cycleways': (serialize_cycleways_sdcc, serialize_cycleways_dublin_metro),
+    'red': (serialize_red_cycling_infrastructure,),
+    'yellow': (serialize_yellow_cycling_infrastructure,),
+    'parking-stands': (serialize_bicycle_parking_stands_sdcc, serialize_dublin_city_parking_stands),
+    'maintenance-stands': (
+        serialize_bike_maintenance_stands_dlr,
+        serialize_bike_maintenance_stands_fcc,
+        serialize_bicycle_maintenance_stands_sdcc,
+    ),
+}
+
+
+def serialize_layer(layer, bbox=None, geometry_field='geometry'):
+    """
+    Serialize every model of a layer into a single GeoJSON FeatureCollection.
+    """
+    features = []
+    for serializer in LAYER_SERIALIZERS[layer]:
+        features += serializer(bbox=bbox, geometry_field=geometry_field)['features']
+    return {
+        'type': 'FeatureCollection',
+        'features': features,
+    }
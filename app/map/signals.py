@@ -0,0 +1,75 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import connections, transaction
+
+from .cache import invalidate_layer
+from .serializers import LAYER_MODELS
+
+# Layers built from each model
+MODEL_LAYERS = {}
+for _layer, _models in LAYER_MODELS.items():
+    for _model in _models:
+        MODEL_LAYERS.setdefault(_model, []).append(_layer)
+
+# Layers changed inside the innermost deferred_invalidation block of the current thread
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_invalidation():
+    """
+    Collect the layers changed by the saves and deletes inside the block and bump each
+    version once when it ends, instead of once per row in bulk loads and computations.
+    """
+    if getattr(_deferred, 'layers', None) is not None:
+        # Nested block, the outermost one bumps the versions
+        yield
+        return
+    _deferred.layers = set()
+    try:
+        yield
+    finally:
+        layers, _deferred.layers = _deferred.layers, None
+        for layer in layers:
+            schedule_invalidation(layer)
+
+
+def schedule_invalidation(layer):
+    """
+    Bump a layer version once the current transaction commits, so a request running in
+    between cannot cache the old rows under the new version.
+    """
+    transaction.on_commit(lambda: invalidate_layer(layer))
+
+
+def layer_model_changed(sender, **kwargs):
+    """
+    post_save/post_delete receiver bumping the versions of the layers built from a model.
+    """
+    layers = getattr(_deferred, 'layers', None)
+    for layer in MODEL_LAYERS.get(sender, ()):
+        if layers is not None:
+            layers.add(layer)
+        else:
+            schedule_invalidation(layer)
+
+
+def bulk_delete(queryset):
+    """
+    Delete the rows of a queryset of a layer model in one DELETE and bump its layer
+    versions. A plain delete() fetches every row first to send post_delete, because
+    receivers are connected; none of these models has cascades or receivers of its own.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    rows, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} IN ({rows})",
+            params,
+        )
+        deleted = cursor.rowcount
+    layer_model_changed(model)
+    return deleted
@@ -89,6 +89,32 @@ function createPopupContent(feature, markerCoords) {
     return popupContent;
 }
 
+/**
+ * Adds GeoJSON data to a given Leaflet layer group, replacing its current contents.
+ *
+ * @param {Object} data - The GeoJSON FeatureCollection to add.
+ * @param {L.LayerGroup} layerGroup - The Leaflet layer group to which the GeoJSON data will be added.
+ * @param {Object} [style=null] - Optional styling options for the GeoJSON layer and markers.
+ */
+function addGeoJSON(data, layerGroup, style = null) {
+    layerGroup.clearLayers();
+
+    L.geoJSON(data, {
+        style: style || undefined,
+        pointToLayer: (feature, latlng) => {
+            // Apply custom marker styling
+            const iconStyle = createMarkerIcon(style || 'default');
+            return L.marker(latlng, { icon: iconStyle });
+        },
+        onEachFeature: (feature, layer) => {
+            const { coordinates } = feature.geometry;
+            const markerCoords = [coordinates[1], coordinates[0]]; // [lat, lng]
+            const popupContent = createPopupContent(feature, markerCoords); // Create popup content
+            layer.bindPopup(popupContent); // Bind popup with route button
+        },
+    }).addTo(layerGroup);
+}
+
 /**
  * Asynchronously loads GeoJSON data from a specified endpoint and adds it to a given Leaflet layer group.
  *
@@ -104,27 +130,35 @@ async function loadGeoJSON(endpoint, layerGroup, style = null) {
         const response = await fetch(`${API_BASE}${endpoint}/`);
         if (!response.ok) throw new Error(`Failed to fetch ${endpoint}: ${response.statusText}`);
         const data = await response.json();
-        layerGroup.clearLayers();
-
-        L.geoJSON(data, {
-            style: style || undefined,
-            pointToLayer: (feature, latlng) => {
-                // Apply custom marker styling
-                const iconStyle = createMarkerIcon(style || 'default');
-                return L.marker(latlng, { icon: iconStyle });
-            },
-            onEachFeature: (feature, layer) => {
-                const { coordinates } = feature.geometry;
-                const markerCoords = [coordinates[1], coordinates[0]]; // [lat, lng]
-                const popupContent = createPopupContent(feature, markerCoords); // Create popup content
-                layer.bindPopup(popupContent); // Bind popup with route button
-            },
-        }).addTo(layerGroup);
+        addGeoJSON(data, layerGroup, style);
     } catch (error) {
         console.error(`Error loading ${endpoint}:`, error);
     }
 }
 
+/**
+ * Asynchronously loads several layers in a single request from the batched layers endpoint
+ * and adds each of them to its layer group.
+ *
+ * @param {Object} layers - Layer group and style of each layer, keyed by layer name (e.g. { red: [redInfrastructureLayerGroup, redInfrastructureStyle] }).
+ * @returns {Promise<boolean>} A promise that resolves to true when every layer has been loaded.
+ */
+async function loadLayers(layers) {
+    const include = Object.keys(layers).join(',');
+    try {
+        const response = await fetch(`${API_BASE}layers/?include=${include}`);
+        if (!response.ok) throw new Error(`Failed to fetch ${include}: ${response.statusText}`);
+        const data = await response.json();
+        for (const [name, [layerGroup, style]] of Object.entries(layers)) {
+            addGeoJSON(data[name], layerGroup, style);
+        }
+        return true;
+    } catch (error) {
+        console.error(`Error loading ${include}:`, error);
+        return false;
+    }
+}
+
 ///---Infrastructure Layers---///
 /**
  * Asynchronously loads cycleways GeoJSON data and adds it to the specified layer group with the given style.
@@ -414,18 +448,29 @@ async function registerServiceWorker() {
 
 // On document load event listener - load cycleways, fetch user location, and register service worker
 document.addEventListener('DOMContentLoaded', async () => {
-    // Initialize Segregated Cycleways (always loaded)
-    await loadCycleways();
-    userLocation = await fetchAndUpdateLocation();
-    await registerServiceWorker();
     // Layer visibility control
     const cyclewaysCheckbox = document.getElementById('cyclewaysLayer');
     const redCheckbox = document.getElementById('redInfrastructureLayer');
     const yellowCheckbox = document.getElementById('yellowInfrastructureLayer');
+    const amenitiesDropdown = document.getElementById('amenities-dropdown');
+
+    // Initialize Segregated Cycleways (always loaded) in one request together with the
+    // layers and amenity category the browser restored as selected
+    const initialLayers = { cycleways: [cyclewaysLayerGroup, cyclewayStyle] };
+    if (redCheckbox.checked) initialLayers.red = [redInfrastructureLayerGroup, redInfrastructureStyle];
+    if (yellowCheckbox.checked) initialLayers.yellow = [yellowInfrastructureLayerGroup, yellowInfrastructureStyle];
+    const staticCategories = { parking_stands: 'parking-stands', maintenance_stands: 'maintenance-stands' };
+    const initialCategory = staticCategories[amenitiesDropdown.value];
+    if (initialCategory) initialLayers[initialCategory] = [categoryLayerGroup, 'green'];
+    const initialLayersLoaded = await loadLayers(initialLayers);
+    if (!initialLayersLoaded) await loadCycleways();
+    if (amenitiesDropdown.value !== 'default' && (!initialCategory || !initialLayersLoaded)) await loadSelectedCategory();
+    userLocation = await fetchAndUpdateLocation();
+    await registerServiceWorker();
 
     // Flags to track if data is already loaded
-    let redInfrastructureLoaded = false;
-    let yellowInfrastructureLoaded = false;
+    let redInfrastructureLoaded = initialLayersLoaded && redCheckbox.checked;
+    let yellowInfrastructureLoaded = initialLayersLoaded && yellowCheckbox.checked;
 
     // Event listeners for toggling layers
     cyclewaysCheckbox.addEventListener('change', () => {
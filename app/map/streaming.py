@@ -0,0 +1,44 @@
+import json
+
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .serializers import LAYER_MODELS, MODEL_FIELDS, filter_bbox
+
+# Rows fetched per round trip from the server-side cursor
+STREAM_CHUNK_SIZE = 2000
+
+# Features encoded per chunk handed to the WSGI server
+FEATURES_PER_CHUNK = 500
+
+
+def stream_layer(layer, bbox=None, geometry_field='geometry'):
+    """
+    Yield a layer as an encoded GeoJSON FeatureCollection, chunk by chunk.
+
+    Geometries come out of PostGIS already encoded by ST_AsGeoJSON and rows are
+    read through a server-side cursor, so memory stays flat however large the layer is.
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    chunk = []
+    first = True
+    for model in LAYER_MODELS[layer]:
+        concrete = {field.name for field in model._meta.concrete_fields}
+        fields = [name for name in MODEL_FIELDS[model] if name in concrete]
+        rows = (
+            filter_bbox(model.objects.all(), bbox)
+            .annotate(geojson=AsGeoJSON(geometry_field))
+            .values_list('pk', 'geojson', *fields)
+            .iterator(chunk_size=STREAM_CHUNK_SIZE)
+        )
+        for pk, geometry, *values in rows:
+            properties = json.dumps(dict(zip(fields, values)), cls=DjangoJSONEncoder)
+            feature = f'{{"type":"Feature","id":{json.dumps(pk)},"properties":{properties},"geometry":{geometry or "null"}}}'
+            chunk.append(feature if first else ',' + feature)
+            first = False
+            if len(chunk) >= FEATURES_PER_CHUNK:
+                yield ''.join(chunk).encode('utf-8')
+                chunk = []
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+    yield b']}'
@@ -1,15 +1,63 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from rest_framework import status
 from unittest.mock import patch
+import asyncio
+import datetime
+import gzip
+import io
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import json
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import F, Q
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import StreamingHttpResponse
+from django.utils.cache import has_vary_header
 from django.contrib.auth.models import User
-from map.models import BicycleParkingStandSDCC, Profile
-from django.contrib.gis.geos import Point
+from map.models import (
+    BicycleParkingStandSDCC,
+    CyclewaysSDCC,
+    CountyCycleway,
+    CountyRoad,
+    CyclewayChange,
+    CyclewaysDublinMetro,
+    LayerVersion,
+    Profile,
+    RedCyclingInfrastructure,
+    YellowCyclingInfrastructure,
+)
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import Point, LineString, MultiLineString
+from map.infrastructure import STRtree, compute_road, partition_roads
+from map.artifacts import ARTIFACT_SUFFIXES, batch_artifact_name, open_file
+from map.cache import get_layer_version
+from map.load import bulk_load, content_hash, copy_value, datasets, sync_dataset
+from map.signals import bulk_delete, deferred_invalidation
+from map import feeds, history
+from map.adapters import afetch_dublin_bikes_geojson, fetch_dublin_bikes_geojson, get_async_client
+from map.live import format_event
 
 
 class MapsAPITestCase(APITestCase):
     
     def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.artifact_dir = directory.name
+        artifact_settings = override_settings(LAYER_ARTIFACT_DIR=directory.name)
+        artifact_settings.enable()
+        self.addCleanup(artifact_settings.disable)
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.profile = Profile(user=self.user)
         self.profile.save()
@@ -85,19 +133,173 @@ class MapsAPITestCase(APITestCase):
         mock_create_user.assert_called_once_with(username='newuser', email='newuser@example.com', password='newpassword')
     
 
-    @patch('map.views.serialize_bicycle_parking_stands_sdcc')
-    @patch('map.views.serialize_dublin_city_parking_stands')
-    def test_parking_stands_geojson_view(self, mock_serialize_dcc, mock_serialize_sdcc):
-        mock_serialize_sdcc.return_value = {'features': [{'properties': {'location': 'Test Location'}}]}
-        mock_serialize_dcc.return_value = {'features': []}
+    @patch('map.artifacts.serialize_layer')
+    def test_parking_stands_geojson_view(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {
+            'type': 'FeatureCollection',
+            'features': [{'properties': {'location': 'Test Location'}}],
+        }
         self.client.force_authenticate(user=self.user)
         
+        response = self.client.get(self.parking_stands_url, {'zoom': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['features'][0]['properties']['location'], 'Test Location')
+        # Point layers have no generalized columns, the zoom is ignored
+        mock_serialize_layer.assert_called_once_with('parking-stands', geometry_field='geometry')
+
+        self.client.get(self.parking_stands_url)
+        mock_serialize_layer.assert_called_once()
+
+    def test_layer_conditional_get(self):
+        self.client.force_authenticate(user=self.user)
+
         response = self.client.get(self.parking_stands_url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # The current version is confirmed from its row alone, no layer query runs
+        with self.assertNumQueries(2):
+            response = self.client.get(self.parking_stands_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # Each encoding is its own representation
+        response = self.client.get(self.parking_stands_url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT_ENCODING='gzip')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('features', response.data)
-        self.assertEqual(response.data['features'][0]['properties']['location'], 'Test Location')
-        mock_serialize_sdcc.assert_called_once()
-        mock_serialize_dcc.assert_called_once()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parking_stand.save()
+        response = self.client.get(self.parking_stands_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_layer_bbox_etag_follows_renderer(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.parking_stands_url, {'bbox': '0,0,2,2'}, HTTP_ACCEPT='application/json')
+        self.assertTrue(has_vary_header(response, 'Accept'))
+        # The browsable API renders the same features into another body
+        browsable = self.client.get(self.parking_stands_url, {'bbox': '0,0,2,2'}, HTTP_ACCEPT='text/html')
+        self.assertNotEqual(browsable['ETag'], response['ETag'])
+        browsable = self.client.get(
+            self.parking_stands_url, {'bbox': '0,0,2,2'}, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(browsable.status_code, status.HTTP_200_OK)
+
+    @patch('map.artifacts.serialize_layer')
+    def test_layer_artifact_etag_names_encoding_served(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+
+        identity = self.client.get(self.red_cycling_geojson_url)
+        for name in os.listdir(self.artifact_dir):
+            if name.endswith(ARTIFACT_SUFFIXES['gzip']):
+                os.remove(os.path.join(self.artifact_dir, name))
+        # Without its gzip file the artifact is sent as is, under the identity ETag
+        response = self.client.get(self.red_cycling_geojson_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['ETag'], identity['ETag'])
+        response = self.client.get(
+            self.red_cycling_geojson_url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=identity['ETag']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @patch('map.artifacts.serialize_layer')
+    def test_layer_manifest(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': [{'type': 'Feature'}]}
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('layer-manifest'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        layer = response.data['layers']['parking-stands']
+        self.assertEqual(layer['version'], get_layer_version('parking-stands'))
+        self.assertEqual(layer['feature_count'], 1)
+        self.assertEqual(layer['url'], self.parking_stands_url)
+
+        # The listed size is the size of the body the layer endpoint serves
+        response = self.client.get(self.parking_stands_url)
+        self.assertEqual(layer['bytes'], len(b''.join(response.streaming_content)))
+        # One build per layer, the layer request reuses the artifact the manifest built
+        self.assertEqual(mock_serialize_layer.call_count, 5)
+
+    @patch('map.artifacts.serialize_layer')
+    def test_batched_layers(self, mock_serialize_layer):
+        mock_serialize_layer.side_effect = lambda layer, geometry_field='geometry': {
+            'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'properties': {'layer': layer}}],
+        }
+        self.client.force_authenticate(user=self.user)
+        url = reverse('api-layers')
+
+        response = self.client.get(url, {'include': 'red,parking-stands,red'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(list(data), ['red', 'parking-stands'])
+        self.assertEqual(data['parking-stands']['features'][0]['properties']['layer'], 'parking-stands')
+
+        # Built layers are spliced into new combinations without serializing them again
+        response = self.client.get(url, {'include': 'parking-stands'})
+        self.assertEqual(list(json.loads(b''.join(response.streaming_content))), ['parking-stands'])
+        self.assertEqual(mock_serialize_layer.call_count, 2)
+
+        response = self.client.get(url, {'include': 'parking-stands'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(url, {'include': 'red,unknown'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('map.artifacts.serialize_layer')
+    def test_only_stale_batches_removed(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+        url = reverse('api-layers')
+
+        self.client.get(url, {'include': 'red'})
+        self.client.get(url, {'include': 'parking-stands'})
+        red_batch = batch_artifact_name(['red'], [get_layer_version('red')])
+        parking_batch = batch_artifact_name(['parking-stands'], [get_layer_version('parking-stands')])
+
+        # A new red version drops the batches holding the old one, other batches stay in place
+        with self.captureOnCommitCallbacks(execute=True):
+            RedCyclingInfrastructure.objects.create(
+                name='Test Road',
+                geometry=MultiLineString(LineString((0, 0), (1, 1)))
+            )
+        self.client.get(self.red_cycling_geojson_url)
+        names = os.listdir(self.artifact_dir)
+        self.assertFalse(any(name.startswith(red_batch) for name in names))
+        self.assertIn(f'{parking_batch}.json', names)
+
+    def test_parking_stands_bbox_filter(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.parking_stands_url, {'bbox': '0,0,2,2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['features']), 1)
+
+        response = self.client.get(self.parking_stands_url, {'bbox': '10,10,11,11'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['features']), 0)
+
+    def test_parking_stands_streaming(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.parking_stands_url, {'stream': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 1)
+        self.assertEqual(data['features'][0]['properties']['location'], 'Test Location')
+        self.assertEqual(data['features'][0]['geometry']['type'], 'Point')
+
+    def test_invalid_bbox(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.cycleways_url, {'bbox': '0,0,2'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Invalid bbox')
 
     @patch('map.views.Profile.objects.get_or_create')
     def test_user_location_view(self, mock_get_or_create):
@@ -120,76 +322,856 @@ class MapsAPITestCase(APITestCase):
         self.assertIn('authenticated', response.data)
         self.assertTrue(response.data['authenticated'])
 
-    @patch('map.views.fetch_dublin_bikes_geojson')
-    def test_dublin_bikes_geojson_view(self, mock_fetch_dublin_bikes_geojson):
-        mock_fetch_dublin_bikes_geojson.return_value = {'features': []}
+    @patch('map.feeds.fetch_feed')
+    def test_dublin_bikes_geojson_view(self, mock_fetch_feed):
+        mock_fetch_feed.return_value = {'features': []}
         self.client.force_authenticate(user=self.user)
         
         response = self.client.get(self.dublin_bikes_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('features', response.data)
-        mock_fetch_dublin_bikes_geojson.assert_called_once()
+        self.assertEqual(response['Age'], '0')
+        mock_fetch_feed.assert_called_once_with('dublin-bikes')
 
-    @patch('map.views.fetch_general_bikes_geojson')
-    def test_bleeper_bikes_geojson_view(self, mock_fetch_general_bikes_geojson):
-        mock_fetch_general_bikes_geojson.return_value = {'features': []}
+    @patch('map.feeds.fetch_feed')
+    def test_bleeper_bikes_geojson_view(self, mock_fetch_feed):
+        mock_fetch_feed.return_value = {'features': []}
         self.client.force_authenticate(user=self.user)
         
         response = self.client.get(self.bleeper_bikes_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('features', response.data)
-        mock_fetch_general_bikes_geojson.assert_called_once_with('https://data.smartdublin.ie/bleeperbike-api/bikes/bleeper_bikes/current/bikes.geojson')
+        mock_fetch_feed.assert_called_once_with('bleeper-bikes')
 
-    @patch('map.views.fetch_general_bikes_geojson')
-    def test_moby_bikes_geojson_view(self, mock_fetch_general_bikes_geojson):
-        mock_fetch_general_bikes_geojson.return_value = {'features': []}
+    @patch('map.feeds.fetch_feed')
+    def test_moby_bikes_geojson_view(self, mock_fetch_feed):
+        mock_fetch_feed.return_value = {'features': []}
         self.client.force_authenticate(user=self.user)
         
         response = self.client.get(self.moby_bikes_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('features', response.data)
-        mock_fetch_general_bikes_geojson.assert_called_once_with('https://data.smartdublin.ie/mobybikes-api/bikes/mobymoby_dublin/current/bikes.geojson')
+        mock_fetch_feed.assert_called_once_with('moby-bikes')
+
+    @patch('map.feeds.fetch_feed')
+    def test_live_feed_serves_last_good_snapshot(self, mock_fetch_feed):
+        mock_fetch_feed.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+        self.client.get(self.dublin_bikes_url)
+
+        # Upstream is down and the snapshot has expired
+        mock_fetch_feed.return_value = {'error': 'HTTP Error: 503 - Service Unavailable'}
+        key = feeds.FEED_CACHE_KEY.format(name='dublin-bikes')
+        entry = cache.get(key)
+        entry['fetched_at'] -= 3600
+        cache.set(key, entry)
+        cache.set(feeds.POLLER_HEARTBEAT_KEY.format(name='dublin-bikes'), 0)
+
+        response = self.client.get(self.dublin_bikes_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['stale'])
+        self.assertGreaterEqual(int(response['Age']), 3600)
+
+    @patch('map.feeds.fetch_feed')
+    def test_live_feed_delta_since_version(self, mock_fetch_feed):
+        def station(number, bikes):
+            return {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [-6.26, 53.34]},
+                'properties': {'Station Number': number, 'Bikes Available': bikes},
+            }
+
+        mock_fetch_feed.return_value = {'type': 'FeatureCollection', 'features': [station(1, 5), station(2, 3)]}
+        self.client.force_authenticate(user=self.user)
+        version = self.client.get(self.dublin_bikes_url).data['version']
+
+        mock_fetch_feed.return_value = {'type': 'FeatureCollection', 'features': [station(1, 4), station(3, 9)]}
+        feeds.refresh_feed('dublin-bikes')
 
-    @patch('map.views.serialize_red_cycling_infrastructure')
-    def test_red_cycling_geojson_view(self, mock_serialize_red_cycling_infrastructure):
-        mock_serialize_red_cycling_infrastructure.return_value = {'features': []}
+        response = self.client.get(self.dublin_bikes_url, {'since': version})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('features', response.data)
+        self.assertGreater(response.data['version'], version)
+        self.assertEqual(response.data['added'], [station(3, 9)])
+        self.assertEqual(response.data['changed'], [station(1, 4)])
+        self.assertEqual(response.data['removed'], [2])
+
+        # Versions that are no longer kept get the full snapshot
+        response = self.client.get(self.dublin_bikes_url, {'since': 1})
+        self.assertEqual(len(response.data['features']), 2)
+
+        response = self.client.get(self.dublin_bikes_url, {'since': 'latest'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('map.feeds.afetch_feed')
+    def test_async_dublin_bikes_view(self, mock_afetch_feed):
+        mock_afetch_feed.return_value = {'features': []}
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('async-dublin-bikes'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('features', response.json())
+        mock_afetch_feed.assert_awaited_once_with('dublin-bikes')
+
+    def test_live_feed_events_unknown_feed(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('live-feed-events', args=['unknown']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_live_feed_events_rejected_under_wsgi(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('live-feed-events', args=['dublin-bikes']))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+
+    def test_async_live_feed_requires_login(self):
+        response = self.client.get(reverse('async-dublin-bikes'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @patch('map.feeds.fetch_feed')
+    def test_live_feed_error(self, mock_fetch_feed):
+        mock_fetch_feed.return_value = {'error': 'HTTP Error: 503 - Service Unavailable'}
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.dublin_bikes_url)
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @patch('map.artifacts.serialize_layer')
+    def test_red_cycling_geojson_view(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
         self.client.force_authenticate(user=self.user)
         
         response = self.client.get(self.red_cycling_geojson_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('features', response.data)
-        mock_serialize_red_cycling_infrastructure.assert_called_once()
+        self.assertIn('features', json.loads(b''.join(response.streaming_content)))
+        mock_serialize_layer.assert_called_once_with('red', geometry_field='geometry')
 
-    @patch('map.views.serialize_yellow_cycling_infrastructure')
-    def test_yellow_cycling_geojson_view(self, mock_serialize_yellow_cycling_infrastructure):
-        mock_serialize_yellow_cycling_infrastructure.return_value = {'features': []}
+    @patch('map.artifacts.serialize_layer')
+    def test_yellow_cycling_geojson_view(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
         self.client.force_authenticate(user=self.user)
         
         response = self.client.get(self.yellow_cycling_geojson_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('features', response.data)
-        mock_serialize_yellow_cycling_infrastructure.assert_called_once()
+        self.assertIn('features', json.loads(b''.join(response.streaming_content)))
+        mock_serialize_layer.assert_called_once_with('yellow', geometry_field='geometry')
         
         
-    @patch('map.views.serialize_cycleways_dublin_metro')
-    def test_cycleways_geojson_view(self, mock_serialize_cycleways_dublin_metro):
-        mock_serialize_cycleways_dublin_metro.return_value = {'features': []}
+    @patch('map.artifacts.serialize_layer')
+    def test_cycleways_geojson_view(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
         # Authenticate the user
         self.client.force_authenticate(user=self.user)
 
         response = self.client.get(self.cycleways_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('features', response.data)
-        mock_serialize_cycleways_dublin_metro.assert_called_once()
-        
-    @patch('map.views.serialize_bike_maintenance_stands_dlr')
-    def test_maintenance_stands_geojson_view(self, mock_serialize_bike_maintenance_stands_dlr):
-        mock_serialize_bike_maintenance_stands_dlr.return_value = {'features': []}
+        self.assertIn('features', json.loads(b''.join(response.streaming_content)))
+        mock_serialize_layer.assert_called_once_with('cycleways', geometry_field='geometry')
+
+    @patch('map.artifacts.serialize_layer')
+    def test_layer_artifact_served_from_cache(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+
+        self.client.get(self.red_cycling_geojson_url)
+        response = self.client.get(self.red_cycling_geojson_url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'{"type":"FeatureCollection","features":[]}')
+        mock_serialize_layer.assert_called_once_with('red', geometry_field='geometry')
+
+    @patch('map.artifacts.serialize_layer')
+    def test_layer_artifact_rebuilt_after_model_change(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+
+        self.client.get(self.red_cycling_geojson_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            RedCyclingInfrastructure.objects.create(
+                name='Test Road',
+                geometry=MultiLineString(LineString((0, 0), (1, 1)))
+            )
+        self.client.get(self.red_cycling_geojson_url)
+        self.assertEqual(mock_serialize_layer.call_count, 2)
+        # The files of the previous version are removed once the new one is written
+        version = get_layer_version('red')
+        self.assertTrue(all(name.startswith(f'red-{version}-') for name in os.listdir(self.artifact_dir)))
+
+    @patch('map.artifacts.serialize_layer')
+    def test_layer_artifact_removed_by_cleanup_is_rebuilt(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+
+        self.client.get(self.red_cycling_geojson_url)
+        # Another worker's cleanup removes the files after this one found the version
+        for name in os.listdir(self.artifact_dir):
+            os.remove(os.path.join(self.artifact_dir, name))
+        response = self.client.get(self.red_cycling_geojson_url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'{"type":"FeatureCollection","features":[]}')
+        self.assertEqual(mock_serialize_layer.call_count, 2)
+
+    @patch('map.artifacts.serialize_layer')
+    def test_layer_zoom_serves_generalized_geometry(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(self.yellow_cycling_geojson_url, {'zoom': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_serialize_layer.assert_called_once_with('yellow', geometry_field='geometry_low')
+
+        response = self.client.get(self.yellow_cycling_geojson_url, {'zoom': 'far'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('map.tiles.render_model_tile')
+    def test_layer_tile_view(self, mock_render_model_tile):
+        mock_render_model_tile.return_value = b'tile'
+        self.client.force_authenticate(user=self.user)
+        url = reverse('layer-tile', args=['cycleways', 14, 8000, 5300])
+
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertEqual(response.content, b'tiletile')
+        # One render per model of the layer, the second request is a cache hit
+        self.assertEqual(mock_render_model_tile.call_count, 2)
+
+    def test_layer_tile_rendered_by_postgis(self):
+        self.client.force_authenticate(user=self.user)
+
+        # The tile holding the parking stand at (1, 1)
+        response = self.client.get(reverse('layer-tile', args=['parking-stands', 14, 8237, 8146]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content)
+        self.assertIn(b'bicycleparkingstandsdcc', response.content)
+
+        response = self.client.get(reverse('layer-tile', args=['parking-stands', 14, 0, 0]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'')
+
+    def test_layer_tile_view_not_found(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('layer-tile', args=['unknown', 0, 0, 0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('layer-tile', args=['red', 2, 4, 0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cycleway_changes_recorded(self):
+        cycleway = CountyCycleway.objects.create(geometry=MultiLineString(LineString((0, 0), (1, 1)), srid=4326))
+        cycleway.geometry = MultiLineString(LineString((2, 2), (3, 3)), srid=4326)
+        cycleway.save()
+        cycleway.delete()
+
+        # Creation, the old and new geometry of the edit, and the deletion
+        self.assertEqual(CyclewayChange.objects.count(), 4)
+        self.assertEqual(CyclewayChange.objects.first().geometry.extent, (0, 0, 1, 1))
+
+    def test_cycleway_changes_recorded_for_queryset_writes(self):
+        CountyCycleway.objects.create(name='Lane', geometry=MultiLineString(LineString((0, 0), (1, 1)), srid=4326))
+        CyclewayChange.objects.all().delete()
+
+        # Other columns are not geometry changes
+        CountyCycleway.objects.update(name='Renamed')
+        self.assertEqual(CyclewayChange.objects.count(), 0)
+
+        CountyCycleway.objects.update(geometry=MultiLineString(LineString((2, 2), (3, 3)), srid=4326))
+        CountyCycleway.objects.all().delete()
+        self.assertEqual(
+            sorted(change.geometry.extent for change in CyclewayChange.objects.all()),
+            [(0, 0, 1, 1), (2, 2, 3, 3), (2, 2, 3, 3)],
+        )
+
+    @patch('map.artifacts.serialize_layer')
+    def test_maintenance_stands_geojson_view(self, mock_serialize_layer):
+        mock_serialize_layer.return_value = {'type': 'FeatureCollection', 'features': []}
         # Authenticate the user
         self.client.force_authenticate(user=self.user)
 
         response = self.client.get(self.maintenance_stands_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('features', response.data)
-        mock_serialize_bike_maintenance_stands_dlr.assert_called_once()
+        self.assertIn('features', json.loads(b''.join(response.streaming_content)))
+        mock_serialize_layer.assert_called_once_with('maintenance-stands', geometry_field='geometry')
+
+    def test_layer_version_bumped_on_commit(self):
+        version = get_layer_version('parking-stands')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parking_stand.status = 'Removed'
+            self.parking_stand.save()
+        self.assertGreater(get_layer_version('parking-stands'), version)
+
+        # Rows changed inside a deferred block bump the version once
+        version = get_layer_version('parking-stands')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks, deferred_invalidation():
+            self.parking_stand.save()
+            self.parking_stand.delete()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_layer_version('parking-stands'), version + 1)
+
+    def test_layer_version_shared_through_database(self):
+        version = get_layer_version('red')
+        # Process-local caches play no part, a bump by any process is seen by every worker
+        cache.clear()
+        self.assertEqual(get_layer_version('red'), version)
+        LayerVersion.objects.filter(layer='red').update(version=F('version') + 1)
+        self.assertEqual(get_layer_version('red'), version + 1)
+
+    def test_bulk_delete_bumps_version_in_one_query(self):
+        for x in range(3):
+            RedCyclingInfrastructure.objects.create(
+                name='Test Road', geometry=MultiLineString(LineString((x, 0), (x + 1, 1)))
+            )
+        version = get_layer_version('red')
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            self.assertEqual(bulk_delete(RedCyclingInfrastructure.objects.all()), 3)
+        self.assertFalse(RedCyclingInfrastructure.objects.exists())
+        self.assertEqual(get_layer_version('red'), version + 1)
+
+
+class ArtifactBuildTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_concurrent_builds_coalesced(self):
+        path = self.directory / 'red-1-geometry.json'
+        builds = []
+
+        def build():
+            builds.append(path)
+            time.sleep(0.2)
+            path.write_bytes(b'{}')
+
+        threads = [threading.Thread(target=lambda: open_file(path, build).close()) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The other workers waited for the build instead of repeating it
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(os.listdir(self.directory), ['red-1-geometry.json'])
+
+
+class InfrastructureNetworkMixin:
+    """
+    A small road and cycleway network for the calculate_missing_infra tests.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_dir = directory.name
+
+    def calculate(self, **options):
+        call_command('calculate_missing_infra', output_dir=self.output_dir, stdout=io.StringIO(), **options)
+
+    def create_network(self):
+        """
+        Create roads partly covered by a segregated and a shared cycleway, touched by a
+        cycleway at a single point, far from any cycleway and fully segregated.
+        """
+        def road(name, *coordinates):
+            return CountyRoad.objects.create(name=name, geometry=MultiLineString(LineString(*coordinates), srid=4326))
+
+        roads = [
+            road('Overlapping', (0, 0), (10, 0)),
+            road('Touching', (0, 5), (10, 5)),
+            road('Disjoint', (0, 10), (10, 10)),
+            road('Segregated', (20, 0), (22, 0)),
+        ]
+        CyclewaysSDCC.objects.create(
+            featureID=1, name='Segregated', colour=1, linewt=1, geometry=LineString((2, 0), (4, 0), srid=4326)
+        )
+        CyclewaysDublinMetro.objects.create(
+            name='Segregated', twoway='Y', bollard_protected='Y', shape_length='4',
+            geometry=LineString((19, 0), (23, 0), srid=4326),
+        )
+        CountyCycleway.objects.create(name='Shared', geometry=MultiLineString(LineString((6, 0), (8, 0)), srid=4326))
+        CountyCycleway.objects.create(name='Crossing', geometry=MultiLineString(LineString((5, 5), (5, 6)), srid=4326))
+        return roads
+
+    def computed(self):
+        """
+        Return the stored Red and Yellow geometries by road.
+        """
+        return {
+            model: {row.road_id: row.geometry for row in model.objects.all()}
+            for model in (RedCyclingInfrastructure, YellowCyclingInfrastructure)
+        }
+
+    def assertSameResults(self, results, expected):
+        for model in (RedCyclingInfrastructure, YellowCyclingInfrastructure):
+            self.assertEqual(set(results[model]), set(expected[model]))
+            for road_id, geometry in expected[model].items():
+                self.assertAlmostEqual(results[model][road_id].length, geometry.length, places=9)
+                self.assertLess(results[model][road_id].sym_difference(geometry).length, 1e-9)
+
+
+class MissingInfrastructureTestCase(InfrastructureNetworkMixin, TestCase):
+
+    def test_sql_engine_matches_python_engine(self):
+        overlapping, touching, disjoint, segregated = self.create_network()
+
+        self.calculate(engine='python')
+        expected = self.computed()
+        self.calculate(engine='sql')
+        self.assertSameResults(self.computed(), expected)
+
+        red, yellow = expected[RedCyclingInfrastructure], expected[YellowCyclingInfrastructure]
+        self.assertAlmostEqual(yellow[overlapping.pk].length, 8)
+        self.assertAlmostEqual(red[overlapping.pk].length, 6)
+        self.assertAlmostEqual(red[touching.pk].length, 10)
+        self.assertAlmostEqual(red[disjoint.pk].length, 10)
+        # A road with no Yellow part has no rows at all
+        self.assertNotIn(segregated.pk, yellow)
+        self.assertNotIn(segregated.pk, red)
+
+    def test_failed_store_keeps_previous_results(self):
+        self.create_network()
+        previous = RedCyclingInfrastructure.objects.create(
+            name='Previous', geometry=MultiLineString(LineString((0, 0), (1, 1)), srid=4326)
+        )
+        # Red rows are already inserted when storing the Yellow rows fails
+        with patch.object(YellowCyclingInfrastructure.objects, 'bulk_create', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.calculate()
+        self.assertEqual(list(RedCyclingInfrastructure.objects.all()), [previous])
+
+    def test_stored_results_are_generalized(self):
+        self.create_network()
+        self.calculate()
+        for model in (RedCyclingInfrastructure, YellowCyclingInfrastructure):
+            self.assertTrue(model.objects.exists())
+            self.assertFalse(model.objects.filter(Q(geometry_low__isnull=True) | Q(geometry_mid__isnull=True)).exists())
+
+    def test_incremental_recomputes_only_changed_roads(self):
+        overlapping, touching, disjoint, segregated = self.create_network()
+        self.calculate()
+        self.assertFalse(CyclewayChange.objects.exists())
+        rows = dict(RedCyclingInfrastructure.objects.values_list('road_id', 'pk'))
+
+        # A new shared cycleway along the disjoint road is the only change
+        CountyCycleway.objects.create(name='New', geometry=MultiLineString(LineString((2, 10), (3, 10)), srid=4326))
+        self.assertTrue(CyclewayChange.objects.exists())
+        self.calculate(incremental=True)
+
+        red = RedCyclingInfrastructure.objects.get(road=disjoint)
+        self.assertAlmostEqual(red.geometry.length, 9)
+        self.assertNotEqual(red.pk, rows[disjoint.pk])
+        self.assertAlmostEqual(YellowCyclingInfrastructure.objects.get(road=disjoint).geometry.length, 10)
+        # The rows of the other roads are left untouched
+        for road in (overlapping, touching):
+            self.assertEqual(RedCyclingInfrastructure.objects.get(road=road).pk, rows[road.pk])
+        self.assertFalse(CyclewayChange.objects.exists())
+
+    def test_incremental_requires_linked_rows(self):
+        RedCyclingInfrastructure.objects.create(name='Unlinked', geometry=MultiLineString(LineString((0, 0), (1, 1)), srid=4326))
+        with self.assertRaises(CommandError):
+            self.calculate(incremental=True)
+
+    def test_strtree_query(self):
+        lines = [LineString((x, 0), (x + 0.5, 0.5)) for x in range(50)]
+        tree = STRtree(lines, node_capacity=4)
+
+        self.assertEqual(tree.query((10.2, 0.2, 10.3, 0.3)), [lines[10]])
+        self.assertEqual(tree.query((100, 100, 101, 101)), [])
+
+    def test_compute_road(self):
+        road = MultiLineString(LineString((0, 0), (3, 0)), srid=4326)
+        segregated = LineString((0, 0), (1, 0), srid=4326)
+        cycleway = LineString((1, 0), (2, 0), srid=4326)
+        far_away = LineString((10, 10), (11, 10), srid=4326)
+
+        red, yellow = compute_road(road, STRtree([segregated, far_away]), STRtree([cycleway]))
+        self.assertEqual(yellow.geom_type, 'MultiLineString')
+        self.assertAlmostEqual(yellow.length, 2)
+        self.assertAlmostEqual(red.length, 1)
+
+
+class ParallelInfrastructureTestCase(InfrastructureNetworkMixin, TransactionTestCase):
+    """
+    Forked workers open their own connections, so they only see committed rows.
+    """
+
+    def test_partitions_cover_every_road_once(self):
+        self.create_network()
+        for index in range(7):
+            CountyRoad.objects.create(name=f'Road {index}', geometry=MultiLineString(LineString((index, 30), (index, 31)), srid=4326))
+        # Leave gaps in the primary keys
+        CountyRoad.objects.filter(name__in=['Touching', 'Road 2', 'Road 3', 'Road 6']).delete()
+
+        partitions = partition_roads(3)
+        pks = list(CountyRoad.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual([pk for pk in pks for low, high in partitions if low <= pk <= high], pks)
+        self.assertTrue(all(CountyRoad.objects.filter(pk__range=bounds).count() <= 3 for bounds in partitions))
+
+    def test_workers_match_serial_run(self):
+        self.create_network()
+        self.calculate(workers=1, partition_size=1)
+        expected = self.computed()
+        self.calculate(workers=2, partition_size=1)
+        self.assertSameResults(self.computed(), expected)
+
+
+class LoadTestCase(SimpleTestCase):
+
+    def test_copy_value(self):
+        self.assertEqual(copy_value(None), r'\N')
+        self.assertEqual(copy_value(3), '3')
+        self.assertEqual(copy_value('a\tb\nc\\d'), 'a\\tb\\nc\\\\d')
+
+    def test_content_hash(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b'{"type": "FeatureCollection", "features": []}')
+        self.addCleanup(os.remove, f.name)
+
+        self.assertEqual(content_hash(f.name), hashlib.sha256(b'{"type": "FeatureCollection", "features": []}').hexdigest())
+
+
+class GeoJSONFixtureMixin:
+
+    def write_fixture(self, features):
+        with tempfile.NamedTemporaryFile('w', suffix='.geojson', delete=False) as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+
+class BulkLoadTestCase(GeoJSONFixtureMixin, TestCase):
+
+    def test_bulk_load_drops_z(self):
+        # Like the Dublin Metro file, LineStrings with z=0.0 for a 2D column
+        path = self.write_fixture([{
+            'type': 'Feature',
+            'properties': {'Name': 'SegregatedCycleLane', 'twoway': '0', 'bollardpro': '1', 'Shape_Leng': '1.5'},
+            'geometry': {'type': 'LineString', 'coordinates': [[-6.26, 53.34, 0.0], [-6.25, 53.35, 0.0]]},
+        }])
+        mapping = next(dataset['mapping'] for dataset in datasets if dataset['model'] is CyclewaysDublinMetro)
+
+        self.assertEqual(bulk_load(CyclewaysDublinMetro, path, mapping), 1)
+        cycleway = CyclewaysDublinMetro.objects.get()
+        self.assertFalse(cycleway.geometry.hasz)
+        self.assertEqual(cycleway.geometry.coords, ((-6.26, 53.34), (-6.25, 53.35)))
+
+
+    def test_merge_records_cycleway_changes(self):
+        mapping = next(dataset['mapping'] for dataset in datasets if dataset['model'] is CyclewaysSDCC)
+        properties = {'OBJECTID': 1, 'Layer': 'Cycleway', 'Color': 1, 'Linetype': 'Solid', 'LineWt': 1}
+        path = self.write_fixture([
+            {'type': 'Feature', 'properties': properties, 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}},
+            {'type': 'Feature', 'properties': dict(properties, OBJECTID=2), 'geometry': {'type': 'LineString', 'coordinates': [[5, 5], [6, 6]]}},
+        ])
+        bulk_load(CyclewaysSDCC, path, mapping, key='featureID')
+        CyclewayChange.objects.all().delete()
+
+        # Feature 1 moves, feature 2 is unchanged and is left out of the changes
+        path = self.write_fixture([
+            {'type': 'Feature', 'properties': properties, 'geometry': {'type': 'LineString', 'coordinates': [[2, 2], [3, 3]]}},
+            {'type': 'Feature', 'properties': dict(properties, OBJECTID=2), 'geometry': {'type': 'LineString', 'coordinates': [[5, 5], [6, 6]]}},
+        ])
+        bulk_load(CyclewaysSDCC, path, mapping, key='featureID')
+        self.assertEqual(
+            sorted(change.geometry.extent for change in CyclewayChange.objects.all()),
+            [(0, 0, 1, 1), (2, 2, 3, 3)],
+        )
+
+    def test_sync_keeps_computed_infrastructure(self):
+        RedCyclingInfrastructure.objects.create(
+            name='Computed', geometry=MultiLineString(LineString((0, 0), (1, 1)), srid=4326)
+        )
+        dataset = next(dataset for dataset in datasets if dataset['model'] is RedCyclingInfrastructure)
+        path = self.write_fixture([{
+            'type': 'Feature',
+            'properties': {'name': 'Exported'},
+            'geometry': {'type': 'MultiLineString', 'coordinates': [[[0, 0], [1, 1]]]},
+        }])
+
+        self.assertFalse(sync_dataset(dict(dataset, geojson_path=path)))
+        self.assertEqual(RedCyclingInfrastructure.objects.get().name, 'Computed')
+
+
+class ParallelLoadTestCase(GeoJSONFixtureMixin, TransactionTestCase):
+    """
+    Forked workers open their own connections, so they only see committed rows.
+    """
+
+    def setUp(self):
+        metro = self.write_fixture([
+            {
+                'type': 'Feature',
+                'properties': {'Name': f'Lane {index}', 'twoway': '0', 'bollardpro': '1', 'Shape_Leng': '1.5'},
+                'geometry': {'type': 'LineString', 'coordinates': [[index, 0], [index, 1]]},
+            }
+            for index in range(3)
+        ])
+        county = self.write_fixture([
+            {
+                'type': 'Feature',
+                'properties': {'name': f'Cycleway {index}'},
+                'geometry': {'type': 'MultiLineString', 'coordinates': [[[index, 2], [index, 3]]]},
+            }
+            for index in range(5)
+        ])
+        metro_mapping = next(dataset['mapping'] for dataset in datasets if dataset['model'] is CyclewaysDublinMetro)
+        self.datasets = [
+            {'model': CyclewaysDublinMetro, 'geojson_path': metro, 'mapping': metro_mapping},
+            {'model': CountyCycleway, 'geojson_path': county, 'mapping': {'name': 'name', 'geometry': 'MULTILINESTRING'}},
+        ]
+
+    def load(self, datasets, parallel):
+        with patch('map.load.datasets', datasets):
+            call_command('load_data', bulk=True, parallel=parallel, stdout=io.StringIO())
+
+    def test_parallel_load_matches_serial_load(self):
+        self.load(self.datasets, parallel=1)
+        expected = (CyclewaysDublinMetro.objects.count(), CountyCycleway.objects.count())
+        CyclewaysDublinMetro.objects.all().delete()
+        CountyCycleway.objects.all().delete()
+
+        self.load(self.datasets, parallel=2)
+        self.assertEqual((CyclewaysDublinMetro.objects.count(), CountyCycleway.objects.count()), expected)
+        self.assertEqual(expected, (3, 5))
+
+    def test_failing_dataset_fails_parallel_load(self):
+        missing = dict(self.datasets[1], geojson_path=os.path.join(tempfile.gettempdir(), 'missing.geojson'))
+        with self.assertRaises(GDALException):
+            self.load([self.datasets[0], missing], parallel=2)
+
+
+DUBLIN_BIKES_RESPONSE = {
+    'type': 'FeatureCollection',
+    'features': [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [-6.26, 53.34]},
+        'properties': {'address': 'Test Street', 'station_id': 1, 'num_bikes_available': 5, 'num_docks_available': 15},
+    }],
+}
+
+
+class StubFeedHandler(BaseHTTPRequestHandler):
+    """
+    Serve DUBLIN_BIKES_RESPONSE for every GET and count the requests on the server.
+    """
+
+    def do_GET(self):
+        self.server.hits += 1
+        time.sleep(self.server.delay)
+        body = json.dumps(DUBLIN_BIKES_RESPONSE).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubFeedHandler)
+        self.server.hits = 0
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        url = self.url = f'http://127.0.0.1:{self.server.server_port}/stations.geojson'
+        patcher = patch.dict(feeds.FEEDS, {'dublin-bikes': dict(feeds.FEEDS['dublin-bikes'], url=url)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fresh_snapshot_served_from_cache(self):
+        data, age, stale, version = feeds.get_feed('dublin-bikes')
+        self.assertEqual(data['features'][0]['properties']['Bikes Available'], 5)
+        self.assertEqual(age, 0)
+        self.assertFalse(stale)
+
+        data, age, stale, version = feeds.get_feed('dublin-bikes')
+        self.assertEqual(len(data['features']), 1)
+        self.assertEqual(self.server.hits, 1)
+
+    @patch('map.feeds.refresh_in_background')
+    def test_stale_snapshot_served_while_refreshing(self, mock_refresh_in_background):
+        feeds.get_feed('dublin-bikes')
+        key = feeds.FEED_CACHE_KEY.format(name='dublin-bikes')
+        entry = cache.get(key)
+        entry['fetched_at'] -= 120
+        cache.set(key, entry)
+
+        data, age, stale, version = feeds.get_feed('dublin-bikes')
+        self.assertEqual(len(data['features']), 1)
+        self.assertGreaterEqual(age, 120)
+        self.assertTrue(stale)
+        mock_refresh_in_background.assert_called_once_with('dublin-bikes')
+        self.assertEqual(self.server.hits, 1)
+
+    @patch('map.feeds.fetch_feed')
+    def test_circuit_breaker_opens_after_repeated_failures(self, mock_fetch_feed):
+        mock_fetch_feed.return_value = {'error': 'URL Error: timed out'}
+        for _ in range(feeds.BREAKER_THRESHOLD):
+            feeds.refresh_feed('dublin-bikes')
+        self.assertTrue(feeds.breaker_open('dublin-bikes'))
+
+        # Calls are suspended while the breaker is open
+        self.assertIn('error', feeds.refresh_feed('dublin-bikes'))
+        self.assertEqual(mock_fetch_feed.call_count, feeds.BREAKER_THRESHOLD)
+
+    def test_background_refresh(self):
+        feeds.refresh_in_background('dublin-bikes')
+        for _ in range(50):
+            if cache.get(feeds.FEED_CACHE_KEY.format(name='dublin-bikes')):
+                break
+            time.sleep(0.1)
+        self.assertEqual(self.server.hits, 1)
+        self.assertIsNotNone(cache.get(feeds.FEED_CACHE_KEY.format(name='dublin-bikes')))
+
+    def test_concurrent_fetches_coalesced(self):
+        self.server.delay = 0.3
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(fetch_dublin_bikes_geojson(self.url)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.hits, 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_poller_refuses_local_memory_cache(self):
+        with self.assertRaisesMessage(CommandError, 'REDIS_URL'):
+            call_command('poll_feeds')
+
+    def test_async_client_closed_with_its_loop(self):
+        async def fetch():
+            data = await afetch_dublin_bikes_geojson(self.url)
+            return data, get_async_client()
+
+        # Under WSGI every async request runs on a loop of its own like this
+        data, client = asyncio.run(fetch())
+        self.assertEqual(len(data['features']), 1)
+        self.assertTrue(client.is_closed)
+
+    @patch('map.feeds.refresh_in_background')
+    def test_async_stale_snapshot_refreshed_in_background_thread(self, mock_refresh_in_background):
+        feeds.get_feed('dublin-bikes')
+        key = feeds.FEED_CACHE_KEY.format(name='dublin-bikes')
+        entry = cache.get(key)
+        entry['fetched_at'] -= 120
+        cache.set(key, entry)
+
+        self.assertIsNotNone(asyncio.run(feeds.aget_snapshot('dublin-bikes')))
+        mock_refresh_in_background.assert_called_once_with('dublin-bikes')
+        self.assertEqual(self.server.hits, 1)
+
+
+class LiveFeedTestCase(SimpleTestCase):
+
+    def test_diff_features(self):
+        def station(number, bikes, coordinates=(-6.26, 53.34)):
+            return {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': list(coordinates)},
+                'properties': {'Station Number': number, 'Bikes Available': bikes},
+            }
+
+        old = [station(1, 5), station(2, 3), station(3, 0)]
+        new = [station(1, 5), station(2, 4), station(4, 7)]
+        delta = feeds.diff_features('dublin-bikes', old, new)
+
+        self.assertEqual(delta['added'], [station(4, 7)])
+        self.assertEqual(delta['changed'], [station(2, 4)])
+        self.assertEqual(delta['removed'], [3])
+
+    def test_format_event(self):
+        self.assertEqual(format_event('delta', {'removed': [3]}), 'event: delta\ndata: {"removed":[3]}\n\n')
+
+
+class StationHistoryTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(STATION_HISTORY_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def snapshot(self, bikes):
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': None, 'properties': {'Station Number': 7, 'Bikes Available': bikes, 'Free Stations': 40 - bikes}},
+            {'type': 'Feature', 'geometry': None, 'properties': {'Station Number': 8, 'Bikes Available': 1, 'Free Stations': 1}},
+        ]}
+
+    def test_hourly_aggregates(self):
+        midnight = int(time.time()) // 86400 * 86400
+        history.append_snapshot(self.snapshot(4), midnight + 60)
+        history.append_snapshot(self.snapshot(8), midnight + 120)
+        history.append_snapshot(self.snapshot(10), midnight + 3660)
+
+        hours = history.hourly_aggregates(7, days=1)
+        self.assertEqual([hour['samples'] for hour in hours], [2, 1])
+        self.assertEqual(hours[0]['bikes_mean'], 6)
+        self.assertEqual(hours[0]['bikes_min'], 4)
+        self.assertEqual(hours[0]['docks_max'], 36)
+        self.assertEqual(hours[1]['bikes_max'], 10)
+        self.assertEqual(history.hourly_aggregates(99, days=1), [])
+
+    def test_hour_of_day_percentiles(self):
+        midnight = int(time.time()) // 86400 * 86400
+        for offset, bikes in enumerate([0, 10, 20, 30, 40]):
+            history.append_snapshot(self.snapshot(bikes), midnight + offset * 60)
+
+        hours = history.hour_of_day_percentiles(7, days=1, percentiles=(0, 50, 75, 100))
+        self.assertEqual(len(hours), 1)
+        self.assertEqual(hours[0]['bikes'], {'p0': 0, 'p50': 20, 'p75': 30, 'p100': 40})
+
+    def test_unchanged_snapshot_recorded_once(self):
+        cache.clear()
+        feeds.record_result('dublin-bikes', self.snapshot(4))
+        # Every process sharing the same fetch records it again
+        feeds.record_result('dublin-bikes', self.snapshot(4))
+        self.assertEqual(len(history.load_samples(7, days=1)), 1)
+
+        feeds.record_result('dublin-bikes', self.snapshot(5))
+        self.assertEqual(len(history.load_samples(7, days=1)), 2)
+
+    def test_blocks_split_per_station(self):
+        midnight = int(time.time()) // 86400 * 86400
+        history.append_snapshot(self.snapshot(4), midnight + 60)
+        history.append_snapshot(self.snapshot(8), midnight + 120)
+
+        day = datetime.datetime.fromtimestamp(midnight, datetime.timezone.utc).date()
+        self.assertEqual(history.block_path(day, 7).stat().st_size, 2 * history.RECORD_DTYPE.itemsize)
+        self.assertEqual(history.block_path(day, 8).stat().st_size, 2 * history.RECORD_DTYPE.itemsize)
+
+        # Blocks of every station written before the split are still read
+        np.array([(midnight + 180, 7, 6, 14), (midnight + 180, 8, 1, 1)], dtype=history.RECORD_DTYPE).tofile(
+            history.legacy_block_path(day)
+        )
+        self.assertEqual(list(history.load_samples(7, days=1)['bikes']), [4, 8, 6])
+
+    def test_invalid_counts_clamped_or_skipped(self):
+        midnight = int(time.time()) // 86400 * 86400
+        history.append_snapshot({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': None, 'properties': {'Station Number': 7, 'Bikes Available': -3, 'Free Stations': 70000}},
+            {'type': 'Feature', 'geometry': None, 'properties': {'Station Number': 7, 'Bikes Available': None, 'Free Stations': 1}},
+            {'type': 'Feature', 'geometry': None, 'properties': {'Station Number': 70000, 'Bikes Available': 1, 'Free Stations': 1}},
+        ]}, midnight + 60)
 
+        hours = history.hourly_aggregates(7, days=1)
+        self.assertEqual(len(hours), 1)
+        self.assertIs(type(hours[0]['samples']), int)
+        self.assertEqual(hours[0]['samples'], 1)
+        self.assertEqual(hours[0]['bikes_min'], 0)
+        self.assertEqual(hours[0]['docks_max'], history.RECORD_MAX)
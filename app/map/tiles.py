@@ -0,0 +1,99 @@
+from django.core.cache import cache
+from django.db import connection
+
+from .cache import get_layer_version
+from .serializers import LAYER_MODELS, MODEL_FIELDS
+
+# Tile geometry resolution and the clipping buffer around each tile, in tile units
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Highest zoom level tiles are generated for
+MAX_ZOOM = 22
+
+# How long rendered tiles stay cached; entries of older layer versions simply expire
+TILE_CACHE_TIMEOUT = 24 * 60 * 60
+
+TILE_CACHE_KEY = 'tile_{layer}_{version}_{z}_{x}_{y}'
+
+TILE_QUERY = """
+    WITH bounds AS (
+        SELECT
+            ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS tile,
+            ST_Transform(
+                ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), {srid}
+            ) AS search
+    ),
+    features AS (
+        SELECT
+            ST_AsMVTGeom(
+                ST_Transform(t.{geometry}, 3857), bounds.tile, %(extent)s, %(buffer)s, true
+            ) AS geom{columns}
+        FROM {table} t, bounds
+        WHERE t.{geometry} && bounds.search
+    )
+    SELECT ST_AsMVT(features.*, %(name)s, %(extent)s, 'geom')
+    FROM features
+    WHERE geom IS NOT NULL
+"""
+
+
+def is_valid_tile(z, x, y):
+    """
+    Check that tile coordinates exist in the Web Mercator tile pyramid.
+    """
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def render_model_tile(model, z, x, y):
+    """
+    Render one model as an MVT layer, named after the model, with PostGIS ST_AsMVT.
+    """
+    quote = connection.ops.quote_name
+    geometry = model._meta.get_field('geometry')
+    concrete = {field.name: field for field in model._meta.concrete_fields}
+    columns = ''.join(
+        f', t.{quote(concrete[name].column)} AS {quote(name)}'
+        for name in MODEL_FIELDS[model]
+        if name in concrete
+    )
+    sql = TILE_QUERY.format(
+        srid=int(geometry.srid),
+        geometry=quote(geometry.column),
+        columns=columns,
+        table=quote(model._meta.db_table),
+    )
+    params = {
+        'z': z,
+        'x': x,
+        'y': y,
+        'margin': TILE_BUFFER / TILE_EXTENT,
+        'extent': TILE_EXTENT,
+        'buffer': TILE_BUFFER,
+        'name': model._meta.model_name,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b''
+
+
+def render_tile(layer, z, x, y):
+    """
+    Render a layer tile; each model becomes its own MVT layer and the encoded
+    layers are concatenated, which is a valid multi-layer tile.
+    """
+    return b''.join(render_model_tile(model, z, x, y) for model in LAYER_MODELS[layer])
+
+
+def get_tile(layer, z, x, y):
+    """
+    Return the encoded tile for a layer, rendering it on a cache miss.
+    Cache keys include the layer version, so edits to a layer never serve stale tiles.
+    """
+    key = TILE_CACHE_KEY.format(layer=layer, version=get_layer_version(layer), z=z, x=x, y=y)
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(layer, z, x, y)
+        cache.set(key, tile, timeout=TILE_CACHE_TIMEOUT)
+    return tile
@@ -3,7 +3,9 @@ from .views import (
     BleeperBikesGeoJSONView, LoginView, LogoutView,LogoutRedirectView, MobyBikesGeoJSONView, RedCyclingInfrastructureGeoJSONView, RegisterTemplateView, RegisterView, UpdateLocationView,
     CyclewaysGeoJSONView, ParkingStandsGeoJSONView, MaintenanceStandsGeoJSONView,
     UserLocationView, LoginTemplateView, MapTemplateView, OfflineTemplateView,
-    CheckAuthView, YellowCyclingInfrastructureGeoJSONView, root_view, DublinBikesGeoJSONView
+    CheckAuthView, YellowCyclingInfrastructureGeoJSONView, root_view, DublinBikesGeoJSONView,
+    LayerTileView, AsyncLiveFeedView, LiveFeedEventsView, StationHistoryView, StationPercentilesView,
+    LayerManifestView, LayersGeoJSONView
 )
 
 urlpatterns = [
@@ -20,8 +22,17 @@ urlpatterns = [
     path('api/dublin-bikes/',DublinBikesGeoJSONView.as_view(), name='dublin-bikes'),
     path('api/bleeper-bikes/',BleeperBikesGeoJSONView.as_view(), name='bleeper-bikes'),
     path('api/moby-bikes/',MobyBikesGeoJSONView.as_view(), name='moby-bikes'),
+    path('api/dublin-bikes/stations/<int:station>/history/', StationHistoryView.as_view(), name='station-history'),
+    path('api/dublin-bikes/stations/<int:station>/percentiles/', StationPercentilesView.as_view(), name='station-percentiles'),
+    path('api/async/dublin-bikes/', AsyncLiveFeedView.as_view(feed='dublin-bikes'), name='async-dublin-bikes'),
+    path('api/async/bleeper-bikes/', AsyncLiveFeedView.as_view(feed='bleeper-bikes'), name='async-bleeper-bikes'),
+    path('api/async/moby-bikes/', AsyncLiveFeedView.as_view(feed='moby-bikes'), name='async-moby-bikes'),
+    path('api/live/<slug:feed>/events/', LiveFeedEventsView.as_view(), name='live-feed-events'),
     path('api/red-cycling-infrastructure/', RedCyclingInfrastructureGeoJSONView.as_view(), name='red-cycling-geojson'),
     path('api/yellow-cycling-infrastructure/', YellowCyclingInfrastructureGeoJSONView.as_view(), name='yellow-cycling-geojson'),
+    path('api/layers/', LayersGeoJSONView.as_view(), name='api-layers'),
+    path('api/layers/manifest/', LayerManifestView.as_view(), name='layer-manifest'),
+    path('api/tiles/<slug:layer>/<int:z>/<int:x>/<int:y>.pbf', LayerTileView.as_view(), name='layer-tile'),
 
     
     # Template endpoints
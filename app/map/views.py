@@ -1,35 +1,146 @@
 from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.conf import settings
 from django.shortcuts import redirect
+from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout, get_user_model
-from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.gdal import SpatialReference
+from django.contrib.gis.gdal.error import GDALException, SRSException
+from django.core.handlers.asgi import ASGIRequest
 from .models import (
     Profile
 )
-from .serializers import (
-    serialize_cycleways_sdcc,
-    serialize_cycleways_dublin_metro,
-    serialize_bicycle_parking_stands_sdcc,
-    serialize_bicycle_maintenance_stands_sdcc,
-    serialize_bike_maintenance_stands_fcc,
-    serialize_bike_maintenance_stands_dlr,
-    serialize_dublin_city_parking_stands,
-    serialize_red_cycling_infrastructure,
-    serialize_yellow_cycling_infrastructure
-)
-from .adapters import (
-    fetch_general_bikes_geojson,
-    fetch_dublin_bikes_geojson,
+from .serializers import serialize_layer
+from .artifacts import (
+    artifact_response,
+    batch_artifact_name,
+    get_batch_artifact,
+    get_layer_artifact,
+    get_layer_metadata,
+    negotiate_encoding,
 )
+from .cache import get_layer_modified, get_layer_version, layer_etag
+from .serializers import LAYER_MODELS
+from .tiles import get_tile, is_valid_tile
+from .generalization import geometry_field_for_zoom, geometry_field_for_tolerance
+from .streaming import stream_layer
+from .feeds import FEEDS, aget_feed, get_delta, get_feed
+from .live import event_stream
+from .history import hour_of_day_percentiles, hourly_aggregates
 from django.shortcuts import render
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from django.views import View
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+import math
 
 User = get_user_model()
 
 
+def parse_bbox(params):
+    """
+    Parse the optional `bbox=minx,miny,maxx,maxy` and `srid` query parameters into an envelope.
+    Returns None when no bbox is given and raises ValueError when it is malformed.
+    """
+    value = params.get('bbox')
+    if not value:
+        return None
+    coords = [float(coord) for coord in value.split(',')]
+    if len(coords) != 4 or not all(math.isfinite(coord) for coord in coords):
+        raise ValueError('bbox must be four finite numbers')
+    minx, miny, maxx, maxy = coords
+    if minx > maxx or miny > maxy:
+        raise ValueError('bbox minimum must not exceed its maximum')
+    srid = int(params.get('srid', 4326))
+    try:
+        SpatialReference(srid)
+    except (GDALException, SRSException):
+        raise ValueError(f'Unknown srid {srid}')
+    envelope = Polygon.from_bbox(coords)
+    envelope.srid = srid
+    return envelope
+
+
+def parse_geometry_field(params):
+    """
+    Pick the geometry column to serve from the optional `zoom` or `tolerance` query parameters.
+    Raises ValueError when either is malformed.
+    """
+    if params.get('zoom'):
+        return geometry_field_for_zoom(int(params['zoom']))
+    if params.get('tolerance'):
+        tolerance = float(params['tolerance'])
+        if not math.isfinite(tolerance) or tolerance < 0:
+            raise ValueError('tolerance must be a positive number')
+        return geometry_field_for_tolerance(tolerance)
+    return 'geometry'
+
+
+def wants_stream(params):
+    """
+    Check whether the client asked for a streamed response with `stream=true`.
+    """
+    return params.get('stream', '').lower() in ('1', 'true')
+
+
+def streaming_layer_response(layer, bbox=None, geometry_field='geometry'):
+    """
+    Stream a layer straight from PostGIS without materializing it in memory.
+    """
+    return StreamingHttpResponse(
+        stream_layer(layer, bbox=bbox, geometry_field=geometry_field),
+        content_type='application/json',
+    )
+
+
+def conditional_layer_response(request, layer, variant, respond):
+    """
+    Answer a layer request with 304 Not Modified when the client's copy matches the
+    current layer version, before any query or serialization runs; otherwise build
+    the response with `respond` and attach the validators to it.
+    """
+    version = get_layer_version(layer)
+    return conditional_response(
+        request, layer_etag(layer, version, *variant), get_layer_modified(layer, version), respond
+    )
+
+
+def conditional_artifact_response(request, artifact, etag, last_modified):
+    """
+    Serve an open artifact, or 304 Not Modified when the client's copy matches. The encoding
+    is negotiated over the files actually opened and `etag` builds the validator from it, so
+    the ETag always names the body sent; a 304 closes the files again.
+    """
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), artifact)
+    response = conditional_response(
+        request, etag(encoding), last_modified, lambda: artifact_response(artifact, encoding)
+    )
+    if response.status_code == 304:
+        for f in artifact.values():
+            f.close()
+    return response
+
+
+def conditional_response(request, etag, last_modified, respond):
+    """
+    Answer with 304 Not Modified when the client's validators match, otherwise build the
+    response with `respond`, and attach the validators either way.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = respond()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients keep the layer but check it is still current before every use
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
 # Login API
 import logging
 logger = logging.getLogger(__name__)
@@ -184,9 +295,25 @@ class UserLocationView(APIView):
             })
         return Response({'error': 'Location not set'}, status=404)
 
-# Cycleways GeoJSON API
-class CyclewaysGeoJSONView(APIView):
+# Query parameters shared by the layer endpoints
+BBOX_PARAMETERS = [
+    OpenApiParameter('bbox', str, description='Viewport as minx,miny,maxx,maxy'),
+    OpenApiParameter('srid', int, description='SRID of the bbox coordinates, defaults to 4326'),
+    OpenApiParameter('stream', bool, description='Stream the FeatureCollection straight from the database'),
+]
+
+# Query parameters of the line layer endpoints
+GENERALIZATION_PARAMETERS = [
+    OpenApiParameter('zoom', int, description='Map zoom level, lower zooms get simplified geometries'),
+    OpenApiParameter('tolerance', float, description='Largest acceptable simplification tolerance in degrees'),
+]
+
+# Base API for layers served from their pre-serialized artifact
+class LayerGeoJSONView(APIView):
     permission_classes = [IsAuthenticated]
+    layer = None
+    # Point layers have no simplified geometry columns and ignore zoom and tolerance
+    generalized = True
 
     @extend_schema(
         responses={
@@ -196,64 +323,97 @@ class CyclewaysGeoJSONView(APIView):
                     'type': {'type': 'string'},
                     'features': {'type': 'array'}
                 }
-            }
-        }
+            },
+            400: {'description': 'Invalid bbox, zoom or tolerance'}
+        },
+        parameters=BBOX_PARAMETERS + GENERALIZATION_PARAMETERS
     )
     def get(self, request):
-        # Serialize data
-        sdcc_features = serialize_cycleways_sdcc()['features']
-        dublin_metro_features = serialize_cycleways_dublin_metro()['features']
-
-        # Combine features into a single FeatureCollection
-        combined_geojson = {
-            'type': 'FeatureCollection',
-            'features': sdcc_features + dublin_metro_features,
-        }
+        try:
+            bbox = parse_bbox(request.query_params)
+        except ValueError:
+            return Response({'error': 'Invalid bbox'}, status=400)
+        try:
+            geometry_field = parse_geometry_field(request.query_params) if self.generalized else 'geometry'
+        except ValueError:
+            return Response({'error': 'Invalid zoom or tolerance'}, status=400)
+        if wants_stream(request.query_params):
+            return conditional_layer_response(
+                request, self.layer, ('stream', geometry_field, bbox and (bbox.srid, bbox.extent)),
+                lambda: streaming_layer_response(self.layer, bbox, geometry_field),
+            )
+        if bbox is None:
+            version = get_layer_version(self.layer)
+            return conditional_artifact_response(
+                request,
+                get_layer_artifact(self.layer, geometry_field, version),
+                lambda encoding: layer_etag(self.layer, version, 'artifact', geometry_field, encoding),
+                get_layer_modified(self.layer, version),
+            )
+        # The body depends on the renderer DRF negotiated from Accept, e.g. the browsable API
+        response = conditional_layer_response(
+            request, self.layer, ('bbox', geometry_field, bbox.srid, bbox.extent, request.accepted_media_type),
+            lambda: Response(serialize_layer(self.layer, bbox=bbox, geometry_field=geometry_field)),
+        )
+        patch_vary_headers(response, ('Accept',))
+        return response
 
-        return Response(combined_geojson)
-    
 
-# Red Cycling Infrastructure GeoJSON API
-class RedCyclingInfrastructureGeoJSONView(APIView):
-    permission_classes = [IsAuthenticated]
+# Cycleways GeoJSON API
+class CyclewaysGeoJSONView(LayerGeoJSONView):
+    layer = 'cycleways'
 
-    @extend_schema(
-        responses={
-            200: {
-                'type': 'object',
-                'properties': {
-                    'type': {'type': 'string'},
-                    'features': {'type': 'array'}
-                }
-            }
-        }
-    )
-    def get(self, request):
-        red_geojson = serialize_red_cycling_infrastructure()
-        return Response(red_geojson)
+
+# Red Cycling Infrastructure GeoJSON API
+class RedCyclingInfrastructureGeoJSONView(LayerGeoJSONView):
+    layer = 'red'
 
 
 # Yellow Cycling Infrastructure GeoJSON API
-class YellowCyclingInfrastructureGeoJSONView(APIView):
+class YellowCyclingInfrastructureGeoJSONView(LayerGeoJSONView):
+    layer = 'yellow'
+
+# Mapbox Vector Tile API
+class LayerTileView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
         responses={
-            200: {
-                'type': 'object',
-                'properties': {
-                    'type': {'type': 'string'},
-                    'features': {'type': 'array'}
-                }
-            }
+            (200, 'application/vnd.mapbox-vector-tile'): {'type': 'string', 'format': 'binary'},
+            404: {'description': 'Unknown layer or tile'}
         }
     )
-    def get(self, request):
-        yellow_geojson = serialize_yellow_cycling_infrastructure()
-        return Response(yellow_geojson)
+    def get(self, request, layer, z, x, y):
+        if layer not in LAYER_MODELS or not is_valid_tile(z, x, y):
+            return Response({'error': 'Tile not found'}, status=404)
+        return conditional_layer_response(
+            request, layer, ('tile', z, x, y),
+            lambda: HttpResponse(get_tile(layer, z, x, y), content_type='application/vnd.mapbox-vector-tile'),
+        )
 
 # Parking Stands GeoJSON API
-class ParkingStandsGeoJSONView(APIView):
+class ParkingStandsGeoJSONView(LayerGeoJSONView):
+    layer = 'parking-stands'
+    generalized = False
+
+
+# Maintenance Stands GeoJSON API
+class MaintenanceStandsGeoJSONView(LayerGeoJSONView):
+    layer = 'maintenance-stands'
+    generalized = False
+
+
+# URL names of the layer GeoJSON endpoints listed in the layer manifest
+LAYER_URL_NAMES = {
+    'cycleways': 'api-cycleways',
+    'red': 'red-cycling-geojson',
+    'yellow': 'yellow-cycling-geojson',
+    'parking-stands': 'api-parking-stands',
+    'maintenance-stands': 'api-maintenance-stands',
+}
+
+# Layer manifest API, lets offline clients download only the layers that changed
+class LayerManifestView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
@@ -261,114 +421,266 @@ class ParkingStandsGeoJSONView(APIView):
             200: {
                 'type': 'object',
                 'properties': {
-                    'type': {'type': 'string'},
-                    'features': {'type': 'array'}
+                    'layers': {
+                        'type': 'object',
+                        'additionalProperties': {
+                            'type': 'object',
+                            'properties': {
+                                'version': {'type': 'integer'},
+                                'feature_count': {'type': 'integer'},
+                                'bytes': {'type': 'integer'},
+                                'url': {'type': 'string'}
+                            }
+                        }
+                    }
                 }
             }
         }
     )
     def get(self, request):
-        sdcc_parking_features = serialize_bicycle_parking_stands_sdcc()['features']
-        dcc_parking_features = serialize_dublin_city_parking_stands()['features']
-        
-        combined_geojson = {
-            'type': 'FeatureCollection',
-            'features': sdcc_parking_features + dcc_parking_features,
-        }
-        return Response(combined_geojson)
-
-# Maintenance Stands GeoJSON API
-class MaintenanceStandsGeoJSONView(APIView):
+        layers = {}
+        for layer, url_name in LAYER_URL_NAMES.items():
+            metadata = get_layer_metadata(layer)
+            layers[layer] = {
+                'version': metadata['version'],
+                'feature_count': metadata['feature_count'],
+                'bytes': metadata['bytes']['identity'],
+                'url': reverse(url_name),
+            }
+        response = Response({'layers': layers})
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def parse_include(params):
+    """
+    Parse the optional `include=layer,layer` query parameter of the batched layer endpoint
+    into a list of layers without duplicates, every layer when it is not given.
+    Raises ValueError for unknown layers.
+    """
+    value = params.get('include')
+    if not value:
+        return list(LAYER_MODELS)
+    layers = list(dict.fromkeys(layer.strip() for layer in value.split(',') if layer.strip()))
+    unknown = [layer for layer in layers if layer not in LAYER_MODELS]
+    if unknown or not layers:
+        raise ValueError(f"Unknown layers {', '.join(unknown)}")
+    return layers
+
+
+# Batched layers API, several layers in one response keyed by layer name
+class LayersGeoJSONView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
         responses={
             200: {
                 'type': 'object',
-                'properties': {
-                    'type': {'type': 'string'},
-                    'features': {'type': 'array'}
+                'additionalProperties': {
+                    'type': 'object',
+                    'properties': {
+                        'type': {'type': 'string'},
+                        'features': {'type': 'array'}
+                    }
                 }
-            }
-        }
+            },
+            400: {'description': 'Unknown layer'}
+        },
+        parameters=[
+            OpenApiParameter('include', str, description='Comma separated layers, e.g. cycleways,red,yellow,parking-stands. Defaults to every layer'),
+        ]
     )
     def get(self, request):
-        dlr_features = serialize_bike_maintenance_stands_dlr()['features']
-        fcc_features = serialize_bike_maintenance_stands_fcc()['features']
-        sdcc_features = serialize_bicycle_maintenance_stands_sdcc()['features']
-
-        combined_geojson = {
-            'type': 'FeatureCollection',
-            'features': dlr_features + fcc_features + sdcc_features,
-        }
-
-        return Response(combined_geojson)
-    
-# Dublin Bikes Live GeoJSON API
-class DublinBikesGeoJSONView(APIView):
+        try:
+            layers = parse_include(request.query_params)
+        except ValueError:
+            return Response({'error': 'Invalid include'}, status=400)
+        versions = [get_layer_version(layer) for layer in layers]
+        return conditional_artifact_response(
+            request,
+            get_batch_artifact(layers, versions),
+            lambda encoding: f'"{batch_artifact_name(layers, versions)}-{encoding}"',
+            max(get_layer_modified(layer, version) for layer, version in zip(layers, versions)),
+        )
+
+
+def parse_since(params):
+    """
+    Parse the optional `since=<version>` query parameter of the live feeds.
+    Returns None when it is not given and raises ValueError when it is malformed.
+    """
+    value = params.get('since')
+    return int(value) if value else None
+
+
+def live_feed_payload(snapshot, delta=None):
+    """
+    Build a live feed response body: the changes since the client's version when they
+    are known, the full FeatureCollection otherwise, both tagged with the current version.
+    """
+    if delta is not None:
+        return {'version': snapshot.version, 'stale': snapshot.stale, **delta}
+    return dict(snapshot.data, version=snapshot.version, stale=snapshot.stale)
+
+
+LIVE_FEED_PARAMETERS = [
+    OpenApiParameter('since', int, description='Snapshot version held by the client; only the features added, changed or removed since then are returned'),
+]
+
+
+# Base view for the live bike feeds, served from the shared feed cache
+class LiveFeedView(APIView):
     permission_classes = [IsAuthenticated]
+    feed = None
 
     @extend_schema(
+        parameters=LIVE_FEED_PARAMETERS,
         responses={
             200: {
                 'type': 'object',
                 'properties': {
                     'type': {'type': 'string'},
-                    'features': {'type': 'array'}
+                    'features': {'type': 'array'},
+                    'added': {'type': 'array'},
+                    'changed': {'type': 'array'},
+                    'removed': {'type': 'array'},
+                    'version': {'type': 'integer'},
+                    'stale': {'type': 'boolean'}
                 }
             },
+            400: {'description': 'Invalid since'},
             500: {'description': 'Error fetching data'}
         }
     )
     def get(self, request):
-            data = fetch_dublin_bikes_geojson()
-            if 'Error' in data:
-                return Response(data, status=500)
-            return Response(data)
+        try:
+            since = parse_since(request.query_params)
+        except ValueError:
+            return Response({'error': 'Invalid since'}, status=400)
+        snapshot = get_feed(self.feed)
+        if 'error' in snapshot.data:
+            return Response(snapshot.data, status=500)
+        delta = get_delta(self.feed, since, snapshot) if since is not None else None
+        response = Response(live_feed_payload(snapshot, delta))
+        # Seconds since the snapshot was fetched from upstream
+        response['Age'] = str(int(snapshot.age))
+        return response
+
+# Dublin Bikes Live GeoJSON API
+class DublinBikesGeoJSONView(LiveFeedView):
+    feed = 'dublin-bikes'
 
 # Bleeper Bikes Live GeoJSON API
-class BleeperBikesGeoJSONView(APIView):
+class BleeperBikesGeoJSONView(LiveFeedView):
+    feed = 'bleeper-bikes'
+
+# Moby Bikes Live GeoJSON API
+class MobyBikesGeoJSONView(LiveFeedView):
+    feed = 'moby-bikes'
+
+# Longest window the station history endpoints read, in days
+MAX_HISTORY_DAYS = 90
+
+HISTORY_PARAMETERS = [
+    OpenApiParameter('days', int, description='Number of most recent UTC days to include'),
+]
+
+
+# Dublin Bikes station history: hourly aggregates
+class StationHistoryView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
+        parameters=HISTORY_PARAMETERS,
         responses={
             200: {
                 'type': 'object',
                 'properties': {
-                    'type': {'type': 'string'},
-                    'features': {'type': 'array'}
+                    'station': {'type': 'integer'},
+                    'hours': {'type': 'array'}
                 }
             },
-            500: {'description': 'Error fetching data'}
+            400: {'description': 'Invalid days'}
         }
     )
-    def get(self, request):
-        data = fetch_general_bikes_geojson('https://data.smartdublin.ie/bleeperbike-api/bikes/bleeper_bikes/current/bikes.geojson')
-        if 'Error' in data:
-            return Response(data, status=500)
-        return Response(data)
-
-# Moby Bikes Live GeoJSON API
-class MobyBikesGeoJSONView(APIView):
+    def get(self, request, station):
+        try:
+            days = int(request.query_params.get('days', 1))
+        except ValueError:
+            return Response({'error': 'Invalid days'}, status=400)
+        if not 1 <= days <= MAX_HISTORY_DAYS:
+            return Response({'error': 'Invalid days'}, status=400)
+        return Response({'station': station, 'hours': hourly_aggregates(station, days)})
+
+
+# Dublin Bikes station history: percentiles per hour of the day
+class StationPercentilesView(APIView):
     permission_classes = [IsAuthenticated]
 
     @extend_schema(
+        parameters=HISTORY_PARAMETERS + [
+            OpenApiParameter('q', str, description='Comma separated percentiles between 0 and 100, e.g. 10,50,90'),
+        ],
         responses={
             200: {
                 'type': 'object',
                 'properties': {
-                    'type': {'type': 'string'},
-                    'features': {'type': 'array'}
+                    'station': {'type': 'integer'},
+                    'hours': {'type': 'array'}
                 }
             },
-            500: {'description': 'Error fetching data'}
+            400: {'description': 'Invalid days or percentiles'}
         }
     )
-    def get(self, request):
-        data = fetch_general_bikes_geojson('https://data.smartdublin.ie/mobybikes-api/bikes/mobymoby_dublin/current/bikes.geojson')
-        if 'Error' in data:
-            return Response(data, status=500)
-        return Response(data)
+    def get(self, request, station):
+        try:
+            days = int(request.query_params.get('days', 28))
+            percentiles = [float(q) for q in request.query_params.get('q', '10,50,90').split(',')]
+        except ValueError:
+            return Response({'error': 'Invalid days or percentiles'}, status=400)
+        if not 1 <= days <= MAX_HISTORY_DAYS or not all(0 <= q <= 100 for q in percentiles):
+            return Response({'error': 'Invalid days or percentiles'}, status=400)
+        return Response({'station': station, 'hours': hour_of_day_percentiles(station, days, percentiles)})
+
+# Async live feed API: upstream fetches use the pooled keep-alive client and do not block
+# a worker thread while in flight when served through dublin_cycleways.asgi
+class AsyncLiveFeedView(View):
+    feed = None
+
+    async def get(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+        try:
+            since = parse_since(request.GET)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid since'}, status=400)
+        snapshot = await aget_feed(self.feed)
+        if 'error' in snapshot.data:
+            return JsonResponse(snapshot.data, status=500)
+        delta = await sync_to_async(get_delta)(self.feed, since, snapshot) if since is not None else None
+        response = JsonResponse(live_feed_payload(snapshot, delta))
+        response['Age'] = str(int(snapshot.age))
+        return response
+
+# Live feed Server-Sent Events: a full snapshot, then only the stations and bikes that changed
+class LiveFeedEventsView(View):
+
+    async def get(self, request, feed):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+        if feed not in FEEDS:
+            return JsonResponse({'error': 'Feed not found'}, status=404)
+        if not isinstance(request, ASGIRequest):
+            # Under WSGI the stream would hold a worker for as long as the client stays connected
+            return JsonResponse({'error': 'Live feed events are only served by the ASGI server'}, status=503)
+        response = StreamingHttpResponse(event_stream(feed), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 # Check Auth API
 class CheckAuthView(APIView):
     permission_classes = [IsAuthenticated]